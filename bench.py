@@ -0,0 +1,328 @@
+import json
+import os
+import socket
+import struct
+import sys
+import time
+import numpy as np
+from threading import Thread, Event
+
+import common
+import transport
+from dsp import DspPipeline
+from sweep import TxSweep, RxSweep
+
+# ================== simulated devices ================== #
+
+
+class SimImx6Device(Thread):
+    """
+    Local stand-in for the imx6 app (DUT or tester) speaking the INIT/SWITCH protocol of Imx6Controller on UDP.
+    The tester acks every switch with one datagram. The DUT acks INIT with Nbins and answers every switch with
+    NoFasts frames of udpBufferLength bytes (float32: sequence number + Nbins samples).
+    The DUT signal is strong when the tester is switched to the same Rx antenna and weak otherwise,
+    so the cross antenna loss of a sweep looks like a real unit.
+    """
+    SIGNAL_BIN = 190  # bin of the tone (inside the Rx band of Calculator)
+    STRONG = 3.0  # tone amplitude relative to the noise
+    WEAK = 0.3
+    VARIANTS = 4  # different noise realizations per level
+
+    def __init__(self, IP, mode, tester=None):
+        """
+        tester: the simulated tester (DUT only) - its antenna decides the signal level
+        """
+        super().__init__(name='Sim ' + mode, daemon=True)
+        self.mode = mode
+        self.tester = tester
+        self.device = common.Imx6Device(IP, mode)
+        self.device.configFilePath = os.path.join('setup', 'novelda_params_for_tests.xml')
+        self.device.load_params()
+        self.Nbins = self.device.recvBufferLen // 4 - 1
+        self.antenna = None  # Rx antenna of the last switch
+        self.frames = 0  # datagrams sent
+        self.stopped = Event()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(self.device.serverAddress)
+        self.sock.settimeout(0.2)
+
+        if mode == 'DUT':
+            self.bursts = {'strong': self._make_bursts(self.STRONG), 'weak': self._make_bursts(self.WEAK)}
+
+    def _make_bursts(self, amplitude):
+        # [variants, NoFasts, Nbins + 1] float32, word 0 is the sequence number (set when sent)
+        rng = np.random.default_rng(0)
+        n = np.arange(self.Nbins)
+        tone = amplitude * np.sin(2 * np.pi * self.SIGNAL_BIN / common.Calculator.FFT_LEN * n)
+        bursts = np.zeros([self.VARIANTS, self.device.NoFasts, self.Nbins + 1], dtype=np.float32)
+        bursts[:, :, 1:] = tone + rng.standard_normal([self.VARIANTS, self.device.NoFasts, self.Nbins]) * 0.1
+
+        return bursts
+
+    def run(self):
+        seq = 0
+        variant = 0
+
+        while not self.stopped.is_set():
+            try:
+                data, addr = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+
+            if data[:1] == common.Imx6Device.opCode['INIT']:
+                if self.mode == 'DUT':
+                    self.sock.sendto(b'\x01' + struct.pack('H', self.Nbins), addr)
+                continue
+
+            if data[:1] != common.Imx6Device.opCode['SWITCH']:
+                continue
+
+            baseline = data[-1]
+            if self.mode == 'TESTER':
+                rx = list(self.device.baselinesRx)
+                self.antenna = rx.index(baseline) if baseline in rx else None
+                self.sock.sendto(b'\x01', addr)
+                self.frames += 1
+                continue
+
+            # Tx switches use other baselines - the signal level does not matter there
+            rx = list(self.device.baselinesRx)
+            level = 'strong' if baseline in rx and rx.index(baseline) == self.tester.antenna else 'weak'
+            burst = self.bursts[level][variant]
+            variant = (variant + 1) % self.VARIANTS
+
+            for fast in burst:
+                fast[0] = seq
+                seq += 1
+                self.sock.sendto(fast.tobytes(), addr)
+            self.frames += len(burst)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sock.close()
+
+
+class FakeRsaResource:
+    """
+    Stand-in for the pyvisa resource of SignalVu. Answers the queries of RSaDriver and returns a synthetic
+    spectrum (flat noise floor with a peak at every Tx frequency of the Calculator).
+    A recalled rx setup selects the 'tgGainLoss' measurement, any other one the MaxHold spectrum of the tx setup;
+    preset is the state of a restarted SignalVu.
+    """
+    POINTS = 801
+    FETCH_TIME = 0.005  # simulated transfer time of one trace [s]
+
+    def __init__(self):
+        self.timeout = None
+        self.encoding = None
+        self.write_termination = None
+        self.read_termination = None
+        self.commands = []
+        self.output = b''  # answer waiting to be read
+        self.settings = {}  # answers to RSaDriver.SETUP_QUERIES
+        self.preset()
+
+        freqAxis = np.linspace(common.Calculator.startFreq_Ghz, common.Calculator.endFreq_Ghz, self.POINTS)
+        self.spectrum = np.full(self.POINTS, -60.0, dtype=np.float32)
+        for freq in [8.3, 8.58, 8.9]:
+            self.spectrum[np.abs(freqAxis - freq).argmin()] = -20.0
+
+    def write(self, cmd):
+        self.commands.append(cmd)
+        if cmd.upper().startswith('FETCH:SPECTRUM:TRACE?'):
+            # IEEE 488.2 definite length block
+            time.sleep(self.FETCH_TIME)
+            data = self.spectrum.astype('<f4').tobytes()
+            length = str(len(data)).encode()
+            self.output = b'#' + str(len(length)).encode() + length + data + b'\n'
+
+    def read_bytes(self, count):
+        data, self.output = self.output[:count], self.output[count:]
+        return data
+
+    def clear(self):
+        self.output = b''
+
+    def preset(self):
+        self.settings = dict(zip(common.RSaDriver.SETUP_QUERIES, ['specan', '1.5E+9', '40.0E+6', 'NONE']))
+
+    def recall(self, path):
+        self.preset()
+        if 'rx' in os.path.basename(path.replace('\\', '/')):
+            self.settings['DISPlay:WINDow:ACTive:MEASurement?'] = 'tgGainLoss'
+        else:
+            self.settings.update({'SENSe:SPECtrum:FREQuency:CENTer?': '8.5E+9',
+                                  'SENSe:SPECtrum:FREQuency:SPAN?': '2.0E+9',
+                                  'TRACe1:SPECtrum:FUNCtion?': 'MAXHold'})
+
+    def query(self, cmd):
+        self.commands.append(cmd)
+        if cmd.lower() == '*idn?':
+            return 'TEKTRONIX,SIM,0,0'
+        if cmd in self.settings:
+            return self.settings[cmd]
+        if cmd.upper().startswith('MMEMORY:LOAD:STATE'):
+            self.recall(cmd.split('"')[1])
+        return '1'
+
+    def close(self):
+        pass
+
+
+class SimRig:
+    """
+    Tester, DUT and RSA on the loopback interface, connected the same way main.py connects the real ones.
+    """
+    TESTER_IP = '127.0.0.2'
+    DUT_IP = '127.0.0.3'
+
+    def __init__(self):
+        self.simTester = SimImx6Device(self.TESTER_IP, 'TESTER')
+        self.simDut = SimImx6Device(self.DUT_IP, 'DUT', tester=self.simTester)
+        self.simTester.start()
+        self.simDut.start()
+
+        self.tester = self._controller(self.TESTER_IP, 'TESTER')
+        self.dut = self._controller(self.DUT_IP, 'DUT')
+        self.dut.SEQUENCE_HEADER = True  # the simulated DUT numbers its fasts
+        if not transport.run(transport.connect_all(None, self.tester, self.dut)):
+            self.close()
+            raise RuntimeError('simulated devices did not answer')
+
+        self.rsa = common.RSaDriver()
+        self.rsa.rsa = FakeRsaResource()
+        self.rsa.isConnected = True
+        self.rsa.config()
+
+    @staticmethod
+    def _controller(IP, mode):
+        controller = common.Imx6Controller(IP=IP, mode=mode)
+        controller.ping = lambda IP: True  # the simulated devices answer on the loopback - nothing to ping
+        controller.configFilePath = os.path.join('setup', 'novelda_params_for_tests.xml')
+        controller.load_params()
+
+        return controller
+
+    def close(self):
+        self.tester.close()
+        self.dut.close()
+        self.simTester.stop()
+        self.simDut.stop()
+
+
+# ================== benchmarks ================== #
+
+
+def bench_acquisition(rig, bursts=200):
+    # raw DUT burst rate, without any processing
+    frames = rig.simDut.frames
+    start = time.perf_counter()
+    for i in range(bursts):
+        rig.dut.switch('rx', i % 32)
+    elapsed = time.perf_counter() - start
+
+    return {'acquisition_frames_per_s': (rig.simDut.frames - frames) / elapsed}
+
+
+def bench_dsp(rig, bursts=200):
+    # SNR throughput of the Calculator (in this thread and in the DspPipeline worker pool)
+    calc = common.Calculator()
+    block = np.stack([rig.dut.switch('rx', 0).copy() for i in range(calc.NUMBER_OF_SIGNALS)])
+
+    start = time.perf_counter()
+    for i in range(bursts // calc.NUMBER_OF_SIGNALS):
+        calc.snr_batch(block)
+    inThread = bursts / (time.perf_counter() - start)
+
+    pipeline = DspPipeline()
+    try:
+        pipeline.warm_up()  # worker start up is not part of the throughput
+        start = time.perf_counter()
+        futures = [pipeline.submit(block[i % calc.NUMBER_OF_SIGNALS]) for i in range(bursts)]
+        for future in futures:
+            future.result()
+        pool = bursts / (time.perf_counter() - start)
+    finally:
+        pipeline.close()
+
+    return {'dsp_bursts_per_s': inThread, 'dsp_pool_bursts_per_s': pool}
+
+
+def bench_sweep(rig, sn):
+    # full Tx + Rx sweep and the report of one unit
+    calc = common.Calculator()
+    excel_handler = common.ExcelHandler()
+    excel_handler.set_device_info(['3.1', sn, 'sim', 'sim'])
+    frames = rig.simDut.frames
+
+    start = time.perf_counter()
+    TxSweep(rig.tester, rig.dut, rig.rsa, calc, excel_handler).run()
+    rig.dut.clear_buffer()
+    RxSweep(rig.tester, rig.dut, calc, excel_handler).run()
+    sweepTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    notPassed = excel_handler.evaluate()
+    excel_handler.final_excel(notPassed, sn, excel_handler.tx_test_excel(sn), excel_handler.rx_test_excel(sn))
+    reportTime = time.perf_counter() - start
+
+    return {'sweep_s': sweepTime, 'sweep_frames_per_s': (rig.simDut.frames - frames) / sweepTime,
+            'report_s': reportTime}
+
+
+# ================== results ================== #
+
+RESULTS_PATH = os.path.join('test', 'bench_results.json')
+REGRESSION = 0.10  # relative change flagged as a regression
+
+
+def compare(previous, current):
+    # returns the regressions of current against previous. *_per_s metrics are better higher, the others lower
+    regressions = []
+    for name, value in current.items():
+        old = previous.get(name)
+        if not old:
+            continue
+
+        change = (value - old) / old
+        worse = -change if name.endswith('_per_s') else change
+        if worse > REGRESSION:
+            regressions.append('%s: %.4g -> %.4g (%+.1f%%)' % (name, old, value, 100 * change))
+
+    return regressions
+
+
+def run(path=RESULTS_PATH):
+    os.makedirs('test', exist_ok=True)
+    rig = SimRig()
+    try:
+        results = {}
+        results.update(bench_acquisition(rig))
+        results.update(bench_dsp(rig))
+        results.update(bench_sweep(rig, 'BENCH'))
+    finally:
+        rig.close()
+
+    history = []
+    if os.path.exists(path):
+        with open(path) as fp:
+            history = json.load(fp)
+
+    for name, value in results.items():
+        print('%-24s %.4g' % (name, value))
+
+    regressions = compare(history[-1]['results'], results) if history else []
+    for line in regressions:
+        print('### Regression ' + line)
+
+    history.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results})
+    with open(path, 'w') as fp:
+        json.dump(history, fp, indent=1)
+
+    return regressions
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run(*sys.argv[1:]) else 0)
@@ -0,0 +1,198 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+from threading import Lock
+
+import common
+
+# ================== capture format ================== #
+#
+# file:  MAGIC | uint32 header length | header (json: version, device params from the xml, unit info)
+#        followed by chunks until the end of the file
+# chunk: CHUNK (source, measurement, sample type, index, rows, columns) | rows * columns samples
+#
+# source is b'DUT ' (a burst [fast, bin] from Imx6Controller.switch) or b'RSA ' (a spectrum [1, point]).
+# measurement is an index of MEASUREMENTS, index the Tx sector / Rx antenna.
+
+MAGIC = b'TSTCAP01'
+VERSION = 1
+CHUNK = struct.Struct('<4sBcHII')
+MEASUREMENTS = ['tx', 'snr', 'cross']
+
+
+class CaptureWriter:
+    """
+    Records the raw data of one unit at wire speed: every chunk is a small binary header followed by the samples,
+    written through a large file buffer (no per chunk formatting or flushing).
+    Attached to a controller as its recorder, the DUT bursts are recorded while context is set
+    (RxSweep sets it to the measurement being taken once the signal settled); TxSweep records the RSA spectra.
+    """
+    BUFFER = 1 << 20  # bytes of the file buffer
+
+    def __init__(self, path, params=None, info=None):
+        """
+        params: device params (XmlDictConfig of the novelda params xml)
+        info: unit information (e.g. serial number, MAC) kept in the header
+        """
+        self.path = path
+        self.context = None  # (measurement, index) of the DUT bursts being received, None - not recorded
+        self.chunks = 0
+        self.lock = Lock()
+
+        header = json.dumps({'version': VERSION, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                             'params': params or {}, 'info': info or {}}).encode()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.fp = open(path, 'wb', buffering=self.BUFFER)
+        self.fp.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def write(self, source, measurement, index, data):
+        # data - 1d or 2d array (a view is fine, it is copied only if not contiguous)
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        rows, cols = (1, data.shape[0]) if data.ndim == 1 else data.shape
+
+        with self.lock:
+            self.fp.write(CHUNK.pack(source, MEASUREMENTS.index(measurement), b'f', index, rows, cols))
+            self.fp.write(memoryview(data).cast('B'))
+            self.chunks += 1
+
+    def write_burst(self, burst):
+        # called by Imx6Controller.switch for every DUT burst
+        if self.context is not None:
+            self.write(b'DUT ', self.context[0], self.context[1], burst)
+
+    def close(self):
+        with self.lock:
+            if not self.fp.closed:
+                self.fp.close()
+
+
+class CaptureReader:
+    """
+    Reads a capture file through mmap. The chunks are numpy views on the mapping (no copy).
+    A truncated last chunk (crashed run) is ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fp = open(path, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + ' is not a capture file')
+        length = struct.unpack_from('<I', self.mm, len(MAGIC))[0]
+        self.offset = len(MAGIC) + 4 + length
+        header = json.loads(bytes(self.mm[len(MAGIC) + 4:self.offset]).decode())
+        self.params = header['params']
+        self.info = header['info']
+
+    def __iter__(self):
+        # yields (source, measurement, index, data)
+        offset = self.offset
+        size = len(self.mm)
+
+        while offset + CHUNK.size <= size:
+            source, measurement, dtype, index, rows, cols = CHUNK.unpack_from(self.mm, offset)
+            offset += CHUNK.size
+            count = rows * cols
+            dtype = np.dtype(dtype.decode())
+            if offset + count * dtype.itemsize > size:
+                break
+
+            data = np.frombuffer(self.mm, dtype=dtype, count=count, offset=offset).reshape(rows, cols)
+            offset += count * dtype.itemsize
+
+            yield source.decode().strip(), MEASUREMENTS[measurement], index, data
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+
+# ================== offline replay ================== #
+
+
+class Replay:
+    """
+    Feeds a capture back through the Calculator and the limits evaluation of ExcelHandler, so units can be
+    re-scored against new limits files without the hardware.
+    Every burst captured for an Rx measurement is used (the live sweep may have stopped earlier).
+    """
+    def __init__(self, txRefPath=None, rxRefPath=None):
+        """
+        txRefPath, rxRefPath: limits files to score against (the ones in setup if None)
+        """
+        self.calc = common.Calculator()
+        self.txRef = None if txRefPath is None else common.load_reference(txRefPath)
+        self.rxRef = None if rxRefPath is None else common.load_reference(rxRefPath)
+        self.info = None  # unit information of the last capture
+
+    def run(self, path):
+        # returns the ExcelHandler holding the re-scored frames and the number of failed measurements
+        excel_handler = common.ExcelHandler()
+        if self.txRef is not None:
+            excel_handler.txRef = self.txRef
+        if self.rxRef is not None:
+            excel_handler.rxRef = self.rxRef
+
+        reader = CaptureReader(path)
+        try:
+            self._score(reader, excel_handler)
+        finally:
+            # the views on the mapping are gone with _score
+            reader.close()
+        self.info = reader.info
+
+        return excel_handler, excel_handler.evaluate()
+
+    def _score(self, reader, excel_handler):
+        bursts = {}  # (measurement, antenna) -> DUT bursts
+        for source, measurement, index, data in reader:
+            if source == 'RSA':
+                p = self.calc.measures(data[0])
+                excel_handler.txDf.at[index, "8.3GHz [dBm]"] = p[0]
+                excel_handler.txDf.at[index, "8.58GHz [dBm]"] = p[1]
+                excel_handler.txDf.at[index, "8.9GHz [dBm]"] = p[2]
+            else:
+                bursts.setdefault((measurement, index), []).append(data)
+
+        rxDf = excel_handler.rxDf
+        snr = {key: self.calc.snr_batch(np.stack(data))[1] for key, data in bursts.items()}
+        for (measurement, i), SNR in snr.items():
+            if measurement == 'snr':
+                rxDf.at[i, "SNR [dB]"] = SNR
+        for (measurement, i), SNR in snr.items():
+            if measurement == 'cross':
+                rxDf.at[i, "Cross Antenna loss [dB]"] = rxDf["SNR [dB]"][i] - SNR
+
+    def rescore(self, paths):
+        # serial number (or file name) -> number of failed measurements of every capture
+        results = {}
+        for path in paths:
+            excel_handler, notPassed = self.run(path)
+            results[self.info.get('sn', os.path.basename(path))] = notPassed
+
+        return results
+
+
+if __name__ == '__main__':
+    # re-score captured units against (new) limits files, e.g.
+    # python capture.py --tx setup/txRef.xlsx --rx setup/rxRef.xlsx test/*.cap
+    parser = argparse.ArgumentParser(description='Re-score captured units against limits files')
+    parser.add_argument('captures', nargs='+', help='capture files (wildcards are expanded)')
+    parser.add_argument('--tx', help='Tx limits file (setup/txRef.xlsx if not given)')
+    parser.add_argument('--rx', help='Rx limits file (setup/rxRef.xlsx if not given)')
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.captures:
+        paths += sorted(glob.glob(pattern)) or [pattern]
+
+    for sn, notPassed in Replay(args.tx, args.rx).rescore(paths).items():
+        print('%s: %s (%d failed measurements)' % (sn, 'Failed' if notPassed else 'Pass', notPassed))
@@ -3,23 +3,141 @@ import numpy as np
 import os
 import socket
 import struct
+import select
+import errno
+import ctypes
+import ctypes.util
+import functools
 from xml.etree import cElementTree as ElementTree
 import pandas as pd
 from io import StringIO
 from xlsxwriter.exceptions import FileCreateError
 import subprocess
 import sys
+import time
+import json
+import hashlib
 import re  # regular expression
 from fabric import Connection  # ssh connection
-from threading import Thread
-import win32com.client as win32  # expand of the columns in the excel
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from tracing import tracer, traced
+try:
+    import win32com.client as win32  # expand of the columns in the excel (windows only)
+except ImportError:
+    win32 = None
+try:
+    import scipy.fft as scipyFft  # faster (and multithreaded) FFT, float32 in float32 out
+except ImportError:
+    scipyFft = None
+
+
+class SshPool:
+    """
+    Keeps one open SSH connection per (ip, username), shared by the device management helpers
+    and reused for successive DUTs on the same station. Dead connections are evicted and reopened.
+    The pool lock guards only the dicts; the handshake and the health check hold the lock of their own key,
+    so the devices of a station are connected in parallel.
+    """
+    CONNECT_TIMEOUT = 3
+    KEEPALIVE = 15  # seconds between ssh keep-alive packets
+
+    def __init__(self):
+        self.connections = {}
+        self.keyLocks = {}  # (ip, username) -> Lock of the connection
+        self.lock = Lock()
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.keyLocks:
+                self.keyLocks[key] = Lock()
+            return self.keyLocks[key]
+
+    def _peek(self, key):
+        with self.lock:
+            return self.connections.get(key)
+
+    @traced(category='ssh')
+    def get(self, ip, username, password):
+        key = (ip, username)
+
+        with self._key_lock(key):
+            conn = self._peek(key)
+
+            if conn is not None and not self.is_alive(conn):
+                self._discard(key, conn)
+                conn = None
+
+            if conn is None:
+                p = {'password': password}
+                conn = Connection(ip, user=username, connect_kwargs=p, connect_timeout=self.CONNECT_TIMEOUT)
+                conn.open()
+                conn.transport.set_keepalive(self.KEEPALIVE)
+                with self.lock:
+                    self.connections[key] = conn
+
+        return conn
+
+    @classmethod
+    def is_alive(cls, conn):
+        # health check - the transport is up and the device still answers (a round trip on the open session
+        # costs milliseconds, a new handshake seconds)
+        if not conn.is_connected or not conn.transport.is_active():
+            return False
+        try:
+            conn.run('true', hide=True, timeout=cls.CONNECT_TIMEOUT)
+        except Exception:
+            return False
+
+        return True
+
+    def evict(self, ip, username):
+        with self.lock:
+            conn = self.connections.pop((ip, username), None)
+
+        if conn is not None:
+            self._close(conn)
+
+    def evict_if_dead(self, ip, username):
+        # a failed command (e.g. killall with nothing to kill) does not mean the connection is dead
+        key = (ip, username)
+
+        with self._key_lock(key):
+            conn = self._peek(key)
+            if conn is not None and not self.is_alive(conn):
+                self._discard(key, conn)
+
+    def _discard(self, key, conn):
+        # drop conn from the pool (only if it was not replaced meanwhile) and close it
+        with self.lock:
+            if self.connections.get(key) is conn:
+                del self.connections[key]
+        self._close(conn)
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+
+        for conn in connections:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+sshPool = SshPool()  # shared by run_imx_app, kill_novelda_app and kill_echosystem_app
 
 
 def run_imx_app(mode, ip, username, password, mac):
-    p = {'password': password}
-    conn = Connection(ip, user=username, connect_kwargs=p, connect_timeout=3)
 
     try:
+        conn = sshPool.get(ip, username, password)
+
         if mode == 'TESTER':
             # run "EchoCareTester" app in tester
             conn.run('/home/debian/EchoCareTester > /dev/null 2>&1')  # > /dev/null 2>&1' for dropping the printings
@@ -29,31 +147,29 @@ def run_imx_app(mode, ip, username, password, mac):
             conn.run('/home/debian/EchoCareTester.sh > /dev/null 2>&1')
     except:
         print('Problem with SSH connection to device')
-        pass
+        sshPool.evict_if_dead(ip, username)
 
     return mac
 
 
+@traced(category='ssh')
 def kill_novelda_app(ip, username, password):
-    p = {'password': password}
-    conn = Connection(ip, user=username, connect_kwargs=p, connect_timeout=3)
 
     try:
-        conn.run('killall NoveldaAppMatlab_01.02')
+        sshPool.get(ip, username, password).run('killall NoveldaAppMatlab_01.02')
     except:
         print('Problem with SSH connection to device in kill NoveldaApp')
-        pass
+        sshPool.evict_if_dead(ip, username)
 
 
+@traced(category='ssh')
 def kill_echosystem_app(ip, username, password):
-    p = {'password': password}
-    conn = Connection(ip, user=username, connect_kwargs=p, connect_timeout=3)
 
     try:
-        conn.run('killall EchoSystem')
+        sshPool.get(ip, username, password).run('killall EchoSystem')
     except:
         print('Problem with SSH connection to device in kill EchoSystem')
-        pass
+        sshPool.evict_if_dead(ip, username)
 
 
 def get_mac_with_ssh(connection):
@@ -85,48 +201,135 @@ def get_mac_with_ssh(connection):
     return MACaddresses
 
 
-def update_arp(subnet):
-    def ping(ip_last_byte):
-        r = os.system('ping -n 1 ' + subnet + '.' + str(ip_last_byte))
+DISCOVERY_PORT = 9  # udp discard port - the probes only have to make the OS resolve (ARP) the address
+DISCOVERY_WINDOW = 32  # number of hosts probed before the ARP table is checked again
+
+
+def probe_subnet(subnet, hosts=range(1, 255), window=DISCOVERY_WINDOW, until=None):
+    # send a udp probe to every host of the subnet from one socket, so the OS fills its ARP table.
+    # until - called after every window of probes, stops the sweep when it returns a true value
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    hosts = list(hosts)
+    result = None
 
-    pingThreads = [None] * 256
+    try:
+        for first in range(0, len(hosts), window):
+            for last_byte in hosts[first:first + window]:
+                try:
+                    probe.sendto(b'', (subnet + '.' + str(last_byte), DISCOVERY_PORT))
+                except OSError:  # unreachable host etc.
+                    pass
+
+            if until is not None:
+                time.sleep(0.02)  # let the ARP replies arrive
+                result = until()
+                if result:
+                    break
+    finally:
+        probe.close()
 
-    for i in range(256):
-        pingThreads[i] = Thread(target=ping, kwargs=dict(ip_last_byte=i))
+    return result
 
-    for t in pingThreads:
-        t.start()
 
-    for t in pingThreads:
-        t.join()
+def update_arp(subnet):
+    probe_subnet(subnet)
 
     print('Done')
 
 
-def find_ip_by_mac(mac):
-    # the max should be xx_xx_xx_xx_xx_xx format
+@traced(category='net')
+def discover_ip_by_mac(subnet, mac, timeout=5):
+    # find the IP of a device on the subnet by its MAC address (xx-xx-xx-xx-xx-xx format)
+    # returns the IP (0 if not found in timeout seconds) and how long the discovery took
+    start = time.perf_counter()
 
-    arpStr = subprocess.check_output('arp -a').decode()
+    ip = neighbors.lookup(mac)
+    while not ip and time.perf_counter() - start < timeout:
+        # re-read the table on every check while probing
+        ip = probe_subnet(subnet, until=lambda: neighbors.lookup(mac, missRefresh=0))
 
-    idx = arpStr.find(mac)
+    elapsed = time.perf_counter() - start
 
-    if idx == -1:
+    if ip:
+        print('### Found ' + mac + ' at ' + ip + ' in %.2f s' % elapsed)
+    else:
         print('MAC address was not found !!!')
-        return 0
+        ip = 0
+
+    return ip, elapsed
+
+
+class NeighborTable:
+    """
+    MAC -> IP resolution from the OS neighbor (ARP) table.
+    The table is parsed once into a dict and cached for TTL seconds; /proc/net/arp is read directly where it
+    exists (linux), otherwise 'arp -a' is run once per refresh (windows).
+    """
+    TTL = 10  # seconds a parsed table is used
+    MISS_REFRESH = 0.5  # a missing MAC re-reads the table if it is older than this
+    PROC_ARP = '/proc/net/arp'
+    ARP_LINE = re.compile(r'(\d+\.\d+\.\d+\.\d+)\s+([0-9a-fA-F]{2}(?:[-:][0-9a-fA-F]{2}){5})')
+
+    def __init__(self):
+        self.table = {}  # mac (xx-xx-xx-xx-xx-xx) -> ip
+        self.readTime = None
+        self.lock = Lock()
+
+    def lookup(self, mac, missRefresh=None):
+        # returns the IP of the MAC address, or 0 if it is not in the table
+        if missRefresh is None:
+            missRefresh = self.MISS_REFRESH
+        mac = mac.lower().replace(':', '-')
+
+        with self.lock:
+            if self.readTime is None or time.monotonic() - self.readTime > self.TTL:
+                self._refresh()
+
+            ip = self.table.get(mac)
+
+            if ip is None and time.monotonic() - self.readTime >= missRefresh:
+                self._refresh()
+                ip = self.table.get(mac)
+
+        return ip if ip is not None else 0
+
+    def invalidate(self):
+        with self.lock:
+            self.readTime = None
+
+    def _refresh(self):
+        self.table = self._read_proc() if os.path.exists(self.PROC_ARP) else self._read_arp()
+        self.readTime = time.monotonic()
+
+    def _read_proc(self):
+        # IP address, HW type, Flags, HW address, Mask, Device
+        table = {}
+        with open(self.PROC_ARP) as fp:
+            for line in fp.readlines()[1:]:
+                fields = line.split()
+                if len(fields) >= 4 and fields[2] != '0x0':  # 0x0 - incomplete entry
+                    table[fields[3].lower().replace(':', '-')] = fields[0]
 
-    subStr = arpStr[:idx]
+        return table
 
-    for i in range(len(subStr)):
-        if subStr[len(subStr) - i - 1] != ' ':
-            ipEndIdx = len(subStr) - i
-            break
+    def _read_arp(self):
+        arpStr = subprocess.check_output('arp -a').decode()
 
-    for i in range(ipEndIdx):
-        if subStr[ipEndIdx - i - 1] == ' ':
-            ipStartIdx = ipEndIdx - i
-            break
+        return {mac.lower().replace(':', '-'): ip for ip, mac in self.ARP_LINE.findall(arpStr)}
 
-    return subStr[ipStartIdx:ipEndIdx]
+
+neighbors = NeighborTable()  # shared MAC -> IP cache
+
+
+def find_ip_by_mac(mac):
+    # the max should be xx_xx_xx_xx_xx_xx format
+
+    ip = neighbors.lookup(mac)
+
+    if not ip:
+        print('MAC address was not found !!!')
+
+    return ip
 
 
 def check_user_input(userInput, *args):
@@ -147,6 +350,7 @@ def check_user_input(userInput, *args):
         return re.match("[0-9a-f]{2}([-:]?)[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$", userInput.lower()) is not None
 
 
+@traced(category='net')
 def check_ping(IP):
     r = subprocess.check_output('ping -n 1 ' + IP)
     if 'Destination host unreachable' in r.decode():
@@ -155,14 +359,51 @@ def check_ping(IP):
         return 1
 
 
+class RsaCommandQueue:
+    """
+    Runs the VISA I/O of the RSA on one dedicated worker thread, in the order it was submitted
+    (SignalVu executes its commands in order too). A sweep queues its commands and only waits for the
+    futures it needs. Shared by all the DUTs of a station.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='RSA')
+
+    def submit(self, func, *args):
+        # returns a future of func(*args). its spans are traced for the DUT of the submitting thread
+        return self.executor.submit(self._run, tracer.current_dut(), func, args)
+
+    @staticmethod
+    def _run(dut, func, args):
+        tracer.set_dut(dut)
+        return func(*args)
+
+    def close(self):
+        self.executor.shutdown()
+
+
 class RSaDriver:
+    TRACE_BUFFERS = 2  # a fetched trace stays valid until TRACE_BUFFERS more traces are fetched
+    READ_CHUNK = 1 << 16  # bytes read from VISA at once when streaming a binary block
+    RECALL_TIMEOUT = 30000  # ms. recalling a setup state takes longer than the VISA timeout of config
+    STATE_FILE = os.path.join('setup', 'rsa_state.json')  # setup SignalVu holds, kept between sessions
+    # settings a recalled setup leaves on SignalVu. a preset or a restart of SignalVu also shows the 'specan'
+    # measurement, but not the span, center and MaxHold trace of the tx setup
+    SETUP_QUERIES = ['DISPlay:WINDow:ACTive:MEASurement?', 'SENSe:SPECtrum:FREQuency:CENTer?',
+                     'SENSe:SPECtrum:FREQuency:SPAN?', 'TRACe1:SPECtrum:FUNCtion?']
 
     def __init__(self):
         self.rsa = None  # this is the object which controls the SignalVu SW
         self.txSetupFile = 'setup\\tx_setup.Setup'
         self.rxSetupFile = 'setup\\rx_setup.Setup'
         self.isConnected = False
-
+        self.queue = RsaCommandQueue()  # worker for the VISA I/O of the sweeps
+        self.traces = []  # preallocated float32 trace buffers
+        self.traceIdx = 0
+        self.loadedSetup = None  # (path, sha1) of the state SignalVu holds, None - unknown
+        self.stateChecked = False  # STATE_FILE was checked against SignalVu in this session
+        self.setupHashes = {}  # path -> (mtime, size, sha1) of the setup files
+
+    @traced(category='rsa')
     def connect(self):
 
         rm = pyvisa.ResourceManager()
@@ -188,6 +429,9 @@ class RSaDriver:
             print('### RSA: is connected')
 
         self.isConnected = conncted
+        # SignalVu keeps its state between sessions - checked against STATE_FILE with the first load_setup
+        self.loadedSetup = None
+        self.stateChecked = False
 
         return conncted
 
@@ -200,46 +444,325 @@ class RSaDriver:
 
     def disconnect(self):
 
+        self.queue.close()
         self.rsa.close()
 
-    def load_setup(self, type):
-
+    @traced(category='rsa')
+    def load_setup(self, type, force=False):
+        # recalls the setup state, unless SignalVu already holds the same file (path and content).
+        # returns True if the state was recalled
         startStr = 'MMEMORY:LOAD:STATE "' + os.getcwd() + '\\'
         endStr = '"'
 
-        if type == 'rx':
-            cmd = startStr + self.rxSetupFile
-        elif type == 'tx':
-            cmd = startStr + self.txSetupFile
+        path = self._setup_path(type)
+
+        setup = (path, self._setup_hash(path))
+        if not force and setup == self._held_setup():
+            print(type + " setup is already loaded")
+            return False
 
-        cmd = cmd + endStr
+        cmd = startStr + path + endStr
 
-        self.rsa.write(cmd)  # TBD: need to check return value
+        # *OPC? answers when the state was recalled
+        self.loadedSetup = None
+        self._save_state(None)
+        timeout = self.rsa.timeout
+        self.rsa.timeout = self.RECALL_TIMEOUT
+        try:
+            self.rsa.query(cmd + ';*OPC?')
+        finally:
+            self.rsa.timeout = timeout
+        self.loadedSetup = setup
+        self._save_state(setup)
 
         print(type + " setup is loaded")
 
+        return True
+
+    def loaded_setup(self):
+        # 'tx' or 'rx' - the setup SignalVu holds (unchanged files only), None if unknown
+        held = self._held_setup()
+        for type in ['tx', 'rx']:
+            path = self._setup_path(type)
+            if held == (path, self._setup_hash(path)):
+                return type
+
+        return None
+
+    def _setup_path(self, type):
+        if type == 'rx':
+            return self.rxSetupFile
+        elif type == 'tx':
+            return self.txSetupFile
+
+    def _held_setup(self):
+        # (path, sha1) SignalVu holds. in a new session it is taken from STATE_FILE if SignalVu still answers
+        # SETUP_QUERIES the way it did right after the recall
+        if self.loadedSetup is None and not self.stateChecked:
+            self.stateChecked = True
+            try:
+                with open(self.STATE_FILE) as fp:
+                    state = json.load(fp)
+                if state['settings'] == self._settings():
+                    self.loadedSetup = (state['path'], state['sha1'])
+            except Exception:  # no state file, or SignalVu did not answer
+                pass
+
+        return self.loadedSetup
+
+    def _save_state(self, setup):
+        # setup - (path, sha1) just recalled, None - the state is about to change (removes STATE_FILE)
+        try:
+            if setup is None:
+                if os.path.exists(self.STATE_FILE):
+                    os.remove(self.STATE_FILE)
+                return
+
+            state = {'path': setup[0], 'sha1': setup[1], 'settings': self._settings()}
+            with open(self.STATE_FILE, 'w') as fp:
+                json.dump(state, fp)
+        except Exception:
+            print('Problem with saving the RSA state')
+
+    def _settings(self):
+        return [self.rsa.query(query).strip() for query in self.SETUP_QUERIES]
+
+    def _setup_hash(self, path):
+        # content hash of a setup file, computed again only when the file changes
+        stat = os.stat(path)
+        cached = self.setupHashes.get(path)
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            cached = (stat.st_mtime_ns, stat.st_size, _file_hash(path))
+            self.setupHashes[path] = cached
+
+        return cached[2]
+
+    @traced(category='rsa')
     def get_spectrum_curve(self):
 
+        # returns the trace in a preallocated float32 buffer (valid until TRACE_BUFFERS more fetches), or None
         curve = None
 
         try:
-            curve = self.rsa.query_binary_values('FETCh:SPECtrum:TRACe?', datatype='f', container=np.array)
+            self.rsa.write('FETCh:SPECtrum:TRACe?')
+            curve = self._read_block()
         except:
             print('Problem with getting data from sprctrum')
+            # the rest of a partly read block would be taken for the next answer
+            try:
+                self.rsa.clear()
+            except Exception:
+                pass
 
         return curve
 
+    def _read_block(self):
+        # IEEE 488.2 definite length block: '#', number of length digits, length, little endian float32 data
+        header = self.rsa.read_bytes(2)
+        if header[:1] != b'#' or header[1:2] == b'0':
+            raise ValueError('not a definite length block: ' + repr(header))
+
+        length = int(self.rsa.read_bytes(int(header[1:2])))
+        trace = self._trace_buffer(length // 4)
+        view = memoryview(trace).cast('B')
+
+        # stream the data into the buffer in chunks
+        received = 0
+        while received < length:
+            chunk = self.rsa.read_bytes(min(self.READ_CHUNK, length - received))
+            view[received:received + len(chunk)] = chunk
+            received += len(chunk)
+
+        self.rsa.read_bytes(1)  # termination character
+
+        return trace
+
+    def _trace_buffer(self, points):
+        if not self.traces or self.traces[0].shape[0] != points:
+            self.traces = [np.empty(points, dtype='<f4') for i in range(self.TRACE_BUFFERS)]
+            self.traceIdx = 0
+
+        trace = self.traces[self.traceIdx]
+        self.traceIdx = (self.traceIdx + 1) % self.TRACE_BUFFERS
+
+        return trace
+
+    @traced(category='rsa')
     def init_data_acquition(self):
 
         self.rsa.write('initiate:immediate')
         self.rsa.query('*opc?')
 
+    @traced(category='rsa')
     def refresh_trace(self):
 
-        self.rsa.write('SENSe:SPECtrum:CLEar:RESults')
+        # *OPC? answers when the results were cleared
+        self.rsa.query('SENSe:SPECtrum:CLEar:RESults;*OPC?')
+
 
+# recvmmsg shim (linux only) - receive many datagrams with one syscall
 
-class Imx6Controller(socket.socket):
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.c_void_p), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_recvmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    func.restype = ctypes.c_int
+    return func
+
+
+_recvmmsg = _load_recvmmsg()
+MSG_DONTWAIT = 0x40
+
+
+class BatchReceiver:
+    """
+    Drains a whole burst of datagrams into preallocated rows.
+    Uses recvmmsg (many datagrams per syscall) when available, otherwise a tight recv_into loop.
+    """
+    def __init__(self, sock, blocks, useRecvmmsg=True, gap=None):
+        """
+        sock: the (udp) socket to read from
+        blocks: list of numpy arrays [rows, words] - every row receives one datagram
+        gap: seconds to wait for every next datagram once the first one arrived (the socket timeout if None)
+        """
+        self.sock = sock
+        self.gap = gap
+        self.rows = [[memoryview(row) for row in block] for block in blocks]
+        self.vectors = None
+        self.lengths = [np.zeros(block.shape[0], dtype=np.uint32) for block in blocks]  # bytes received per row
+
+        if useRecvmmsg and _recvmmsg is not None:
+            self.vectors = [self._build_vector(block) for block in blocks]
+
+    @staticmethod
+    def _build_vector(block):
+        # one mmsghdr + iovec per row, pointing straight into the numpy memory
+        n = block.shape[0]
+        iov = (_IoVec * n)()
+        msgs = (_MMsgHdr * n)()
+        rowLen = block.shape[1] * block.itemsize
+
+        for i in range(n):
+            iov[i].iov_base = block.ctypes.data + i * block.strides[0]
+            iov[i].iov_len = rowLen
+            msgs[i].msg_hdr.msg_iov = ctypes.addressof(iov) + i * ctypes.sizeof(_IoVec)
+            msgs[i].msg_hdr.msg_iovlen = 1
+
+        return iov, msgs
+
+    def receive(self, blockIdx):
+        # returns the number of datagrams received into the block (less than the block length on timeout).
+        # waits up to the socket timeout for the first datagram and up to gap for every next one
+        n = len(self.rows[blockIdx])
+        timeout = self.sock.gettimeout()
+        received = 0
+
+        while received < n:
+            wait = timeout if received == 0 or self.gap is None else self.gap
+            ready, _, _ = select.select([self.sock], [], [], wait)
+            if not ready:  # timeout
+                break
+
+            received = self.receive_ready(blockIdx, received)
+
+        return received
+
+    def receive_ready(self, blockIdx, received=0):
+        # reads the datagrams waiting on the (readable) socket into the rows from received on, without blocking.
+        # returns the number of rows filled
+        lengths = self.lengths[blockIdx]
+        n = len(lengths)
+
+        if self.vectors is None:
+            # one datagram can be read, the next ones only while select says more are waiting
+            rows = self.rows[blockIdx]
+            while received < n:
+                lengths[received] = self.sock.recv_into(rows[received])
+                received += 1
+                if not select.select([self.sock], [], [], 0)[0]:
+                    break
+
+            return received
+
+        msgs = self.vectors[blockIdx][1]
+        r = _recvmmsg(self.sock.fileno(), ctypes.addressof(msgs) + received * ctypes.sizeof(_MMsgHdr),
+                      n - received, MSG_DONTWAIT, None)
+        if r < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return received
+            raise OSError(err, os.strerror(err))
+
+        for i in range(received, received + r):
+            lengths[i] = msgs[i].msg_len
+
+        return received + r
+
+
+class FrameBlock:
+    """
+    Bursts of DUT fasts kept as they are received, in one contiguous array of the device data type (float32).
+    Every fast is a record of its header word (seq) and Nbins samples (payload), padded to the datagram length.
+    payload is a [burst, fast, bin] view on the same memory, which feeds Calculator without a copy.
+    Without header (bursts copied out of the receive ring), a fast is its Nbins samples only and payload is
+    C-contiguous.
+    """
+    def __init__(self, bursts, fasts, Nbins, words=None, dataType='f', header=True):
+        """
+        words: length of a fast in words (e.g. the udp buffer length, so a datagram is never truncated).
+        Nbins + 1 if None (Nbins without header)
+        header: every fast starts with its seq word
+        """
+        headerWords = 1 if header else 0
+        if words is None:
+            words = Nbins + headerWords
+        if Nbins + headerWords > words:
+            raise ValueError('%d bins do not fit in a fast of %d words' % (Nbins, words))
+
+        itemType = np.dtype(dataType)
+        self.Nbins = Nbins
+        self.raw = np.zeros([bursts, fasts, words], dtype=itemType)  # [burst, fast, word] - receive rows
+        if header:
+            self.dtype = np.dtype({'names': ['seq', 'payload'], 'formats': [itemType, (itemType, (Nbins,))],
+                                   'offsets': [0, itemType.itemsize], 'itemsize': words * itemType.itemsize})
+        else:
+            self.dtype = np.dtype({'names': ['payload'], 'formats': [(itemType, (Nbins,))],
+                                   'offsets': [0], 'itemsize': words * itemType.itemsize})
+        self.frames = self.raw.view(self.dtype)[..., 0]  # [burst, fast] records
+        self.seq = self.frames['seq'] if header else None
+        self.payload = self.frames['payload']
+
+    @property
+    def shape(self):
+        return self.payload.shape
+
+
+class Imx6Device:
+    """
+    INIT/SWITCH protocol of the imx6 app (DUT or Tester), independent of the transport.
+    Imx6Controller (blocking socket) and the simulated devices of bench.py are built on it.
+    """
     PORT = 5044
     configFilePath = "setup\\novelda_params_for_tests.xml"
 
@@ -251,18 +774,20 @@ class Imx6Controller(socket.socket):
     range = struct.pack("f", 5)
 
     def __init__(self, IP, mode, *args):
-        super().__init__(socket.AF_INET, socket.SOCK_DGRAM)
-
         self.IP = IP
-        self.settimeout(2)  # set timeout for 1 second
         self.serverAddress = (self.IP, self.PORT)
         self.params = None
         self.recvBufferLen = None
         self.fileContentTXT = None  # same as params, but in txt format
         self.NoFasts = None
+        self.framePeriod = None  # seconds between the fasts of a burst
         self.Nbins = 3
         self.mode = mode
         self.isConnected = False
+        self.ping = check_ping  # reachability check of connect (the bench replaces it for the loopback)
+        # DUT bursts: received, with lost fasts (filled), stale fasts dropped, re-requested, given up
+        self.lossStats = {'bursts': 0, 'lossy': 0, 'lostFasts': 0, 'stale': 0, 'retries': 0, 'failed': 0}
+        self.recorder = None  # capture.CaptureWriter of the unit (records the DUT bursts)
 
         if args:  # if args is not empty
             loadParams = args[0]  # first element of args is "True" or "False" (whether load the params or not
@@ -291,26 +816,31 @@ class Imx6Controller(socket.socket):
         root = ElementTree.XML(self.fileContentTXT)
         self.params = XmlDictConfig(root)
         self.NoFasts = int(int(self.params["FPS_Motion"]) * float(self.params["motionTime"]))
+        self.framePeriod = 1 / float(self.params["FPS_Motion"])
         self.recvBufferLen = int(self.params["udpBufferLength"])
 
-    def change_transmition_gain(self, value):
+    def set_transmition_gain(self, value):
+        # update the params (txt) with new transmission gain. returns False if the value is invalid
 
         if type(value) is not int:
             print("value must be an integer !!!")
-            return
+            return False
         if value < 0 or value > 3:
             print("Value mast be  !!!")
-            return
+            return False
 
         self.params["transmitGain"] = str(value)
 
         transmitGianIdx = self.fileContentTXT.find('</transmitGain>')
         self.fileContentTXT = self.fileContentTXT[:transmitGianIdx - 1] + str(value) + self.fileContentTXT[
                                                                                        transmitGianIdx:]
+        return True
 
-        self.connect()  # send new params to novelda (with new transmission gain)
+    def init_command(self):
+        # the command is the opcode and file content
+        return self.opCode["INIT"] + self.fileContentTXT.encode()
 
-    def switch(self, testType, ant):
+    def switch_command(self, testType, ant):
 
         if testType == 'tx':
             baseline = self.baselinesTx[ant]
@@ -320,35 +850,221 @@ class Imx6Controller(socket.socket):
         # antenna number to bytes (uint8)
         antBytes = struct.pack("B", baseline)
 
-        # send cmg to get signal switch
-        cmd = self.opCode["SWITCH"] + self.range + antBytes
+        # cmd to get signal switch
+        return self.opCode["SWITCH"] + self.range + antBytes
 
-        self.sendto(cmd, self.serverAddress)
+    def parse_ack(self, data):
+        # DUT ack for INIT command. returns Nbins, or None if it is not an ack
 
-        # set long buffer length
-        self.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.NoFasts * self.recvBufferLen)
+        # first element in revc buffer should be "1"
+        if data[0] == 1:
+            # the rest of the buffer is Nbins (uint16)
+            return struct.unpack("H", data[1:])[0]
 
-        data = np.zeros([self.NoFasts, self.Nbins])
+        return None
 
-        for i in range(self.NoFasts):
-            try:
-                # receive one fast
-                buffer = self.recv(self.recvBufferLen)
 
-                # if we are in TESTER mode just get ack and return
-                if self.mode == 'TESTER':
-                    return 1
+class Imx6Controller(Imx6Device, socket.socket):
+    RING_SIZE = 2  # number of bursts kept in the receive ring (a returned burst stays valid for RING_SIZE switches)
+    BATCH_RECV = True  # drain a burst with recvmmsg where the OS supports it
+    MAX_LOSS = 0.1  # fraction of the fasts of a burst which may be lost before the burst is re-requested
+    LOSS_FILL = 'interpolate'  # lost fasts are 'interpolate'd from their neighbours or 'mask'ed (zeros)
+    RETRIES = 1  # re-requests of a burst with too many lost fasts
+    SEQUENCE_HEADER = False  # first word of every fast is its sequence number (else fasts are in arrival order)
+    GAP_FRAMES = 10  # frame periods to wait for the next fast of a burst (the socket timeout only for the first)
 
-                parsedData = np.frombuffer(buffer, dtype=np.dtype(self.dataType), count=-1, offset=0)
+    def __init__(self, IP, mode, *args):
+        socket.socket.__init__(self, socket.AF_INET, socket.SOCK_DGRAM)
+        self.settimeout(2)  # set timeout for 1 second
+
+        self.ring = None  # preallocated receive FrameBlock, a burst per slot (DUT only)
+        self.receiver = None  # BatchReceiver bound to the ring
+        self.ringSlot = 0  # next slot to be filled
+        self.scratch = None  # [fast, word] buffer for reordering a burst
+        self.present = None  # fasts of the last burst which were received (the others are filled)
+        self.nextSeq = None  # sequence number of the first fast of the next burst (SEQUENCE_HEADER)
+
+        Imx6Device.__init__(self, IP, mode, *args)
+
+    @traced(category='imx6')
+    def change_transmition_gain(self, value):
+
+        if self.set_transmition_gain(value):
+            self.connect()  # send new params to novelda (with new transmission gain)
+
+    def switch(self, testType, ant):
+        # tester switch and DUT burst are traced separately
+        with tracer.span(self.span_name(), 'imx6'):
+            data = self._switch(testType, ant)
+
+        return self.record(data)
+
+    def span_name(self):
+        return 'DUT burst' if self.mode == 'DUT' else 'TESTER switch'
+
+    def record(self, data):
+        # hands a received burst to the recorder. returns data
+        if self.recorder is not None and isinstance(data, np.ndarray):
+            self.recorder.write_burst(data)
+
+        return data
+
+    def _switch(self, testType, ant):
 
-                data[i, :] = parsedData[1:]
+        # if we are in TESTER mode just get ack and return
+        if self.mode == 'TESTER':
+            # send cmg to get signal switch
+            self.sendto(self.switch_command(testType, ant), self.serverAddress)
 
+            try:
+                self.recv(self.recvBufferLen)
+                return 1
             except socket.timeout:
                 print("Time out !!!")
                 return 0
 
-        return data
+        slot = self.next_slot()
+
+        for attempt in range(self.RETRIES + 1):
+            self.request(testType, ant, attempt)
+
+            # receive all the fasts straight into their rows
+            burst = self.assemble(slot, self.receiver.receive(slot))
+            if burst is not None:
+                return burst
+
+        return self.give_up()
+
+    def next_slot(self):
+        # ring slot of the next burst (the ring is allocated with the first burst of a shape)
+        if self.ring is None or self.ring.shape[1:] != (self.NoFasts, self.Nbins):
+            self.allocate_ring()
+
+        slot = self.ringSlot
+        self.ringSlot = (self.ringSlot + 1) % self.ring.shape[0]
+
+        return slot
+
+    def request(self, testType, ant, attempt=0):
+        # sends the switch command of a DUT burst (attempt > 0 - re-request of the same burst)
+        if attempt:
+            self.lossStats['retries'] += 1
+
+        # late fasts of the previous burst must not be taken for this one
+        self.lossStats['stale'] += self._drain()
+        self.sendto(self.switch_command(testType, ant), self.serverAddress)
+
+    def give_up(self):
+        self.lossStats['failed'] += 1
+        print("Time out !!!")
+        return 0
 
+    def assemble(self, slot, received):
+        # put the received fasts of the slot in order and fill the lost ones.
+        # returns the burst [NoFasts, Nbins], or None when more than MAX_LOSS of the fasts were lost
+        rows = self.ring.raw[slot]
+        self.lossStats['bursts'] += 1
+
+        # a short (truncated) datagram is a lost fast
+        valid = self.receiver.lengths[slot][:received] >= (self.Nbins + 1) * rows.itemsize
+
+        if self.SEQUENCE_HEADER:
+            seq = self.ring.seq[slot, :received].astype(np.int64)
+            if received == self.NoFasts and valid.all() and (np.diff(seq) == 1).all() and \
+                    (self.nextSeq is None or seq[0] == self.nextSeq):
+                self.nextSeq = int(seq[-1]) + 1
+                self.present = None
+                return self.ring.payload[slot]
+
+            # every switch is answered with NoFasts numbered fasts, so the burst starts where the previous one ended.
+            # unknown (first burst) or numbering jumped (app restarted) - the burst ends at the newest fast
+            start = self.nextSeq
+            if valid.any():
+                newest = int(seq[valid].max())
+                if start is None or not start <= newest < start + self.NoFasts:
+                    start = newest - self.NoFasts + 1
+            if start is not None:
+                self.nextSeq = start + self.NoFasts
+
+            # older fasts are late fasts of an earlier burst
+            positions = seq - (start if start is not None else 0)
+            stale = valid & (positions < 0)
+            self.lossStats['stale'] += int(stale.sum())
+            valid &= ~stale
+        else:
+            if received == self.NoFasts and valid.all():
+                self.present = None
+                return self.ring.payload[slot]
+
+            # arrival order - the received fasts are the first ones
+            positions = np.arange(received)
+
+        present = np.zeros(self.NoFasts, dtype=bool)
+        present[positions[valid]] = True
+        lost = self.NoFasts - int(present.sum())
+
+        if lost > self.MAX_LOSS * self.NoFasts:
+            return None
+
+        self.lossStats['lossy'] += 1
+        self.lossStats['lostFasts'] += lost
+
+        self.scratch[positions[valid]] = rows[:received][valid]
+        self._fill(self.scratch, present)
+        rows[:] = self.scratch
+        self.present = present
+
+        return self.ring.payload[slot]
+
+    def _fill(self, rows, present):
+        # lost rows are zeros ('mask') or linearly interpolated between the nearest received ones
+        missing = np.flatnonzero(~present)
+        if not len(missing):
+            return
+
+        if self.LOSS_FILL == 'mask':
+            rows[missing] = 0
+            return
+
+        have = np.flatnonzero(present)
+        j = np.searchsorted(have, missing)  # first received row after every missing one
+        # before the first / after the last received row the nearest one is copied
+        left = have[np.maximum(j - 1, 0)]
+        right = have[np.minimum(j, len(have) - 1)]
+
+        span = right - left
+        weight = np.where(span > 0, (missing - left) / np.maximum(span, 1), 0).astype(rows.dtype)
+        rows[missing] = rows[left] * (1 - weight)[:, None] + rows[right] * weight[:, None]
+
+    def _drain(self):
+        # discard what is waiting on the socket without blocking. returns the number of datagrams
+        count = 0
+        while select.select([self], [], [], 0)[0]:
+            self.recv(self.recvBufferLen)
+            count += 1
+
+        return count
+
+    def allocate_ring(self, size=None):
+        # preallocate the receive buffers once, so switch() does not allocate per fast or per burst.
+        # every row is as long as the udp buffer, so a datagram is never truncated
+        if size is None:
+            size = self.RING_SIZE
+
+        wordLen = np.dtype(self.dataType).itemsize
+        self.ring = FrameBlock(size, self.NoFasts, self.Nbins, self.recvBufferLen // wordLen, self.dataType)
+        # a lost fast costs a few frame periods, not the socket timeout
+        gap = None if self.framePeriod is None else self.GAP_FRAMES * self.framePeriod
+        self.receiver = BatchReceiver(self, list(self.ring.raw), useRecvmmsg=self.BATCH_RECV, gap=gap)
+        self.scratch = np.zeros(self.ring.raw.shape[1:], dtype=self.ring.raw.dtype)
+        self.ringSlot = 0
+
+    def configure_socket(self):
+        # socket options are applied once (at connect time) and not on every switch
+        # long receive buffer - a whole burst must fit in it
+        self.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.NoFasts * self.recvBufferLen)
+
+    @traced(category='imx6')
     def clear_buffer(self):
 
         while True:
@@ -357,22 +1073,21 @@ class Imx6Controller(socket.socket):
             except socket.timeout:
                 break
 
+    @traced(category='imx6')
     def connect(self):
 
-        if not check_ping(self.IP):
+        if not self.ping(self.IP):
             print('Cannot ping to ' + self.mode)
             return self.isConnected
-        # the command is the opcode and file content
         if self.fileContentTXT is None:
             print("Load novelda params file first !!!")
             return 0
 
+        self.configure_socket()
         self.clear_buffer()
 
-        cmd = self.opCode["INIT"] + self.fileContentTXT.encode()
-
         # send command through udp
-        self.sendto(cmd, self.serverAddress)
+        self.sendto(self.init_command(), self.serverAddress)
 
         if self.mode == 'TESTER':
             r = self.switch('tx', 1)
@@ -389,12 +1104,10 @@ class Imx6Controller(socket.socket):
         try:
             data = self.recv(self.recvBufferLen)
 
-            ack = data[0]
+            Nbins = self.parse_ack(data)
 
-            # first element in revc buffer should be "1"
-            if ack == 1:
-                # the rest of the buffer is Nbins (uint16)
-                self.Nbins = struct.unpack("H", data[1:])[0]
+            if Nbins is not None:
+                self.Nbins = Nbins
                 print("### DUT: is connected")
                 self.isConnected = True
                 return self.Nbins
@@ -404,11 +1117,73 @@ class Imx6Controller(socket.socket):
             return self.isConnected
 
 
+_referenceCache = {}  # path -> (mtime, size, frame) of the limits files parsed by this process
+
+
+def load_reference(path):
+    # reference limits (xlsx) parsed once per station: the values are kept in memory and in a binary sidecar
+    # (<path>.npz) keyed by the file mtime/size and hash, and reloaded automatically when the file changes
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _referenceCache.get(path)
+    if cached is not None and cached[:2] == key:
+        return cached[2].copy()
+
+    sidecarPath = path + '.npz'
+    df = None
+    digest = None
+
+    if os.path.exists(sidecarPath):
+        with np.load(sidecarPath, allow_pickle=False) as sidecar:
+            if (int(sidecar['mtime']), int(sidecar['size'])) != key:
+                # touched - reuse the sidecar only if the content is the same
+                digest = _file_hash(path)
+            if digest is None or str(sidecar['sha1']) == digest:
+                df = pd.DataFrame(sidecar['values'], columns=list(sidecar['columns']))
+
+    if df is None or digest is not None:
+        if df is None:
+            df = pd.read_excel(path)
+        try:
+            np.savez(sidecarPath, values=df.to_numpy(dtype=float), columns=np.array(df.columns, dtype=str),
+                     mtime=key[0], size=key[1], sha1=digest if digest is not None else _file_hash(path))
+        except (OSError, ValueError):  # read only folder / non numeric limits - just keep it in memory
+            pass
+
+    _referenceCache[path] = (key[0], key[1], df)
+
+    return df.copy()
+
+
+def _file_hash(path):
+    with open(path, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+def evaluate_limits(df, df_ref, columns):
+    # margins and pass/fail of the measured columns against the reference limits in one array operation.
+    # a measurement passes when it is above its limit (a missing one fails)
+    # returns (margin, passed) frames with the index of df and the given columns
+    columns = list(columns)
+    margin = df[columns].to_numpy(dtype=float) - df_ref[columns].to_numpy(dtype=float)
+
+    with np.errstate(invalid='ignore'):
+        passed = margin > 0
+
+    return (pd.DataFrame(margin, index=df.index, columns=columns),
+            pd.DataFrame(passed, index=df.index, columns=columns))
+
+
 class ExcelHandler:
 
     def __init__(self):
 
-        self.filePath = 'test\\'  # the name of the folder with results
+        self.filePath = os.path.join('test', '')  # the name of the folder with results
+        self.journalPath = None  # append-only journal of the measurements (json lines), see record
+        self.journal = None
+        self.reportPath = None  # Pass_/Failed_ report written by final_excel
+        self.journalLock = Lock()
         # first sheet - Device INFO
         data = 'Revision, Serial Number, eth MAC, wlan MAC\n'
         self.deviceInfo = pd.read_csv(StringIO(data))
@@ -429,14 +1204,46 @@ class ExcelHandler:
         self.rxDf = pd.DataFrame(index=range(32), columns=col, data=data, dtype=float)
         self.rxDf.index.name = 'Rx #'
 
-        self.txRef = pd.read_excel('setup\\txRef.xlsx')
-        self.rxRef = pd.read_excel('setup\\rxRef.xlsx')
+        self.txRef = load_reference(os.path.join('setup', 'txRef.xlsx'))
+        self.rxRef = load_reference(os.path.join('setup', 'rxRef.xlsx'))
+
+        # (margin, passed) of the measured columns, see evaluate
+        self.txLimits = None
+        self.rxLimits = None
 
     def set_device_info(self, info):
         # info[0] - revision
         # info[1] - serial number
         # info[0] - max address
 
+        # a journal left by an interrupted run is kept aside (recover it before this if needed)
+        if self.leftover_journal(info[1]) is not None:
+            print('Journal of an earlier run moved to ' + self.rotate_journal(info[1]))
+
+        self._set_info(info)
+
+        with self.journalLock:
+            self._close_journal_file()
+            self.journal = open(self.journalPath, 'w')  # every run starts an empty journal
+
+        self._append({'info': list(info)})
+
+    def leftover_journal(self, sn):
+        # path of the journal of an earlier run of sn which did not reach final_excel (None if there is none)
+        journalPath = self.filePath + sn + '.jsonl'
+
+        return journalPath if os.path.exists(journalPath) else None
+
+    def rotate_journal(self, sn):
+        # rename the journal of an earlier run to <sn>.<time>.jsonl. returns the new path
+        journalPath = self.filePath + sn + '.jsonl'
+        rotatedPath = self.filePath + sn + '.' + time.strftime('%Y%m%d_%H%M%S') + '.jsonl'
+        os.replace(journalPath, rotatedPath)
+
+        return rotatedPath
+
+    def _set_info(self, info):
+        self.journalPath = self.filePath + info[1] + '.jsonl'
         self.filePath = self.filePath + info[1] + '.xlsx'  # serial number
         data = 'Revision, Serial Number, eth MAC, wlan MAC\n'
         for str in info:
@@ -444,8 +1251,63 @@ class ExcelHandler:
 
         self.deviceInfo = pd.read_csv(StringIO(data))
 
-        self.save()
+    @traced(category='excel')
+    def record(self, sheet, row, column, value):
+        # store one measurement ('tx' or 'rx' sheet) and append it to the journal.
+        # the xlsx is written once at the end (save) - the journal keeps every completed measurement on disk
+        df = self.txDf if sheet == 'tx' else self.rxDf
+        df.at[row, column] = value
+
+        self._append({'sheet': sheet, 'row': int(row), 'column': column, 'value': float(value)})
+
+    def _append(self, entry):
+        with self.journalLock:
+            if self.journal is None:
+                self.journal = open(self.journalPath, 'a')
+
+            self.journal.write(json.dumps(entry) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def close_journal(self):
+        with self.journalLock:
+            self._close_journal_file()
+
+    def _close_journal_file(self):
+        # journalLock must be held
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    @traced(category='excel')
+    def recover(self, sn):
+        # rebuild the results of a crashed run from its journal and write its final report (reportPath).
+        # the measurements the run did not reach fail. the journal is removed with the report
+        # returns the number of recovered measurements
+        count = 0
+        journalPath = self.filePath + sn + '.jsonl'
+        self.journalPath = journalPath
+
+        with open(journalPath) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # last line of a crashed run may be incomplete
+                    continue
+
+                if 'info' in entry:
+                    self._set_info(entry['info'])
+                else:
+                    df = self.txDf if entry['sheet'] == 'tx' else self.rxDf
+                    df.at[entry['row'], entry['column']] = entry['value']
+                    count += 1
 
+        notPassed = self.evaluate()
+        self.final_excel(notPassed, sn, self.tx_test_excel(sn), self.rx_test_excel(sn))
+
+        return count
+
+    @traced(category='excel')
     def save(self):
         try:
             # write all to excel file
@@ -483,93 +1345,61 @@ class ExcelHandler:
         wb.Save()
         excel.Application.Quit()
 
+    @traced(category='excel')
+    def evaluate(self):
+        # pass/fail of all the Tx and Rx measurements against the limits. returns the number of failures
+        self.txLimits = evaluate_limits(self.txDf, self.txRef, self.txDf.columns[1:])
+        self.rxLimits = evaluate_limits(self.rxDf, self.rxRef, self.rxDf.columns[1:])
+
+        return int((~self.txLimits[1].values).sum() + (~self.rxLimits[1].values).sum())
+
+    @traced(category='excel')
     def rx_test_excel(self, sn):  # check the values of the Rx and color in red the failed result.
 
-        df = pd.read_excel('test//' + sn + '.xlsx', sheet_name=2)
+        if self.rxLimits is None:
+            self.evaluate()
+        margin, passed = self.rxLimits
+
+        # results are already in memory
+        df = self.rxDf.reset_index()
+        df['Test antenna SNR Diff'] = margin['SNR [dB]'].values
+        df['Test cross antenna loss'] = margin['Cross Antenna loss [dB]'].where(
+            margin['Cross Antenna loss [dB]'] < 0, 0).values
 
-        df_ref = pd.read_excel('setup/rxRef.xlsx')
-        df['Test antenna SNR Diff'] = (df['SNR [dB]'] - df_ref['SNR [dB'])
-        df['Test cross antenna loss'] = (df['Cross Antenna loss [dB]'] - df_ref['Cross Antenna loss [dB]'] < 0) * \
-                                  (df['Cross Antenna loss [dB]'] - df_ref['Cross Antenna loss [dB]'])
-        test_threshold = 0
-        df.style.apply(lambda x: ["background:red" if x < test_threshold else "background: green"
-                                  for x in df.test_83GHz], axis=0)
-        df_styled = df.style \
-            .applymap(
-            lambda x: 'background-color: %s' % 'red' if x < test_threshold else 'background-color: %s' % 'white',
-            subset=['Test antenna SNR Diff', 'Test cross antenna loss'])
-        # df_styled.to_excel('test/rx_test.xlsx', engine='openpyxl', index=False)
+        testColumns = {'SNR [dB]': 'Test antenna SNR Diff', 'Cross Antenna loss [dB]': 'Test cross antenna loss'}
 
-        return df_styled
+        return df.style.apply(self._fail_colors, axis=None, passed=passed, testColumns=testColumns)
 
+    @traced(category='excel')
     def tx_test_excel(self, sn):  # check the values of the Tx and color in red the failed result.
 
-        df = pd.read_excel('test//' + sn + '.xlsx',
-                           sheet_name=1)
-        df_ref = pd.read_excel('setup\\txRef.xlsx')
-        df['test_8.3GHz'] = (df['8.3GHz [dBm]'] - df_ref['8.3GHz [dBm]'] < 0) * (
-                df['8.3GHz [dBm]'] - df_ref['8.3GHz [dBm]'])
-        df['test_8.58GHz'] = (df['8.58GHz [dBm]'] - df_ref['8.58GHz [dBm]'] < 0) * (
-                df['8.58GHz [dBm]'] - df_ref['8.58GHz [dBm]'])
-        df['test_8.9GHz'] = (df['8.9GHz [dBm]'] - df_ref['8.9GHz [dBm]'] < 0) * (
-                df['8.9GHz [dBm]'] - df_ref['8.9GHz [dBm]'])
+        if self.txLimits is None:
+            self.evaluate()
+        margin, passed = self.txLimits
+
+        # results are already in memory
+        df = self.txDf.reset_index()
+        testColumns = {}
+        for col in margin.columns:
+            testColumns[col] = 'test_' + col.split(' ')[0]  # e.g. test_8.3GHz
+            df[testColumns[col]] = margin[col].where(margin[col] < 0, 0).values
         df = df.replace(0, '')
 
-        test_threshold = 0
-
-        df_styled = df.style. \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][0] - df_ref['8.3GHz [dBm]'][
-            0]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[0, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][1] - df_ref['8.3GHz [dBm]'][
-            1]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[1, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][2] - df_ref['8.3GHz [dBm]'][
-            2]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[2, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][3] - df_ref['8.3GHz [dBm]'][
-            3]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[3, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][4] - df_ref['8.3GHz [dBm]'][
-            4]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[4, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][5] - df_ref['8.3GHz [dBm]'][
-            5]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[5, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][6] - df_ref['8.3GHz [dBm]'][
-            6]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[6, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.3GHz [dBm]'][7] - df_ref['8.3GHz [dBm]'][
-            7]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[7, ['8.3GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][0] - df_ref['8.58GHz [dBm]'][
-            0]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[0, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][1] - df_ref['8.58GHz [dBm]'][
-            1]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[1, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][2] - df_ref['8.58GHz [dBm]'][
-            2]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[2, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][3] - df_ref['8.58GHz [dBm]'][
-            3]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[3, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][4] - df_ref['8.58GHz [dBm]'][
-            4]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[4, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][5] - df_ref['8.58GHz [dBm]'][
-            5]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[5, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][6] - df_ref['8.58GHz [dBm]'][
-            6]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[6, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.58GHz [dBm]'][7] - df_ref['8.58GHz [dBm]'][
-            7]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[7, ['8.58GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][0] - df_ref['8.9GHz [dBm]'][
-            0]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[0, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][1] - df_ref['8.9GHz [dBm]'][
-            1]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[1, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][2] - df_ref['8.9GHz [dBm]'][
-            2]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[2, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][3] - df_ref['8.9GHz [dBm]'][
-            3]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[3, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][4] - df_ref['8.9GHz [dBm]'][
-            4]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[4, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][5] - df_ref['8.9GHz [dBm]'][
-            5]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[5, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][6] - df_ref['8.9GHz [dBm]'][
-            6]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[6, ['8.9GHz [dBm]']]). \
-            applymap(lambda x: 'background-color: %s' % 'red' if (df['8.9GHz [dBm]'][7] - df_ref['8.9GHz [dBm]'][
-            7]) < 0 else 'background-color: %s' % 'white', subset=pd.IndexSlice[7, ['8.9GHz [dBm]']])
-
-        # df_styled.to_excel('test/tx_test.xlsx', engine='openpyxl', index=False)
-        return df_styled
+        return df.style.apply(self._fail_colors, axis=None, passed=passed, testColumns=testColumns)
+
+    @staticmethod
+    def _fail_colors(df, passed, testColumns):
+        # background of every cell: red for a failed measurement (and its test column), white otherwise
+        colors = pd.DataFrame('', index=df.index, columns=df.columns)
+        failed = np.where(~passed.values, 'background-color: red', 'background-color: white')
 
+        for j, col in enumerate(passed.columns):
+            colors[col] = failed[:, j]
+            colors[testColumns[col]] = failed[:, j]
+
+        return colors
+
+    @traced(category='excel')
     def final_excel(self, failed, sn, df2, df3):  # save the final excel file
         # failed - failed or pass -  for the file's name.
         # df2 -  Tx test
@@ -580,34 +1410,51 @@ class ExcelHandler:
         else:
             file_name = 'Pass_' + sn + '.xlsx'
 
-        writer = pd.ExcelWriter('test\\' + file_name, engine='xlsxwriter')
-        df1 = pd.read_excel('test\\' + sn + '.xlsx', sheet_name=0)
-        df1.to_excel(writer, sheet_name='Device info')
-        df2.to_excel(writer, sheet_name='Tx test')
-        df3.to_excel(writer, sheet_name='Rx test')
-        writer.save()
+        # one write, straight from the frames in memory
+        sheets = [('Device info', self.deviceInfo, False), ('Tx test', df2, True), ('Rx test', df3, True)]
 
-        excel = win32.gencache.EnsureDispatch('Excel.Application')
+        # in the results folder (filePath is the folder, or the <sn>.xlsx in it after set_device_info)
+        self.reportPath = os.path.join(os.path.dirname(self.filePath), file_name)
+        with pd.ExcelWriter(self.reportPath, engine='xlsxwriter') as writer:
+            for name, df, index in sheets:
+                df.to_excel(writer, sheet_name=name, index=index, float_format='%.2f')
 
-        cwd = os.getcwd()
-        wb = excel.Workbooks.Open(cwd + '\\test\\' + file_name)
-        ws = wb.Worksheets("Device info")
-        ws.Columns.AutoFit()
-        ws = wb.Worksheets("Tx test")
-        ws.Columns.AutoFit()
-        ws = wb.Worksheets("Rx test")
-        ws.Columns.AutoFit()
-        wb.Save()
-        excel.Application.Quit()
+                # autofit - the width of every column is its longest text
+                worksheet = writer.sheets[name]
+                for col, width in enumerate(self._column_widths(df, index)):
+                    worksheet.set_column(col, col, width)
+
+        # the report is complete - the journal is not needed anymore
+        self.close_journal()
+        if self.journalPath is not None and os.path.exists(self.journalPath):
+            os.remove(self.journalPath)
 
-        os.remove("test\\" + sn + ".xlsx")
+    @staticmethod
+    def _column_widths(df, index):
+        # width (in characters) of every column as written by to_excel with float_format='%.2f'
+        if not isinstance(df, pd.DataFrame):  # Styler
+            df = df.data
+
+        columns = [(df.index.name, df.index)] if index else []
+        columns += [(col, df[col]) for col in df.columns]
+
+        widths = []
+        for header, values in columns:
+            texts = ['' if header is None else str(header)]
+            texts += ['%.2f' % v if isinstance(v, float) else str(v) for v in values]
+            widths.append(max(len(t) for t in texts) + 2)
+
+        return widths
 
 
 class Calculator:
     freq8GhzIdx = 176  # lowest freq (idx) inside the band for Rx test
     freq9_5GhzIdx = 209  # highest freq (idx) inside the band for Rx test
     NUMBER_OF_SIGNALS = 10  # number of times we average the spectrum
+    MIN_SIGNALS = 4  # minimum number of bursts before the estimator may stop early
+    CONFIDENCE = 0.99  # confidence of an early decision against the limit
     FFT_LEN = 512
+    FFT_WORKERS = 1  # threads of scipy.fft (-1 for all the cores). numpy.fft is used without scipy
     samplingRate_Ghz = 23.238
     startFreq_Ghz = 7.5
     endFreq_Ghz = 9.5
@@ -615,51 +1462,121 @@ class Calculator:
     def __init__(self):
         self.SNR = np.zeros(10)
         self.SNRpointer = 0
-        self.freq = np.linspace(0, self.samplingRate_Ghz / 2, num=int(self.FFT_LEN / 2) + 1)
         self.txFreqPoints = [8.3, 8.58, 8.9]  # in GHz, for tx test
+        self.buffers = {}  # output buffers of snr_batch, reused between calls
+        self.plans = {}  # (fasts, bins, FFT length, spectrum length) -> plan, see plan
+
+    def plan(self, fasts=None, bins=None, specLen=None):
+        # everything the hot loops derive from the data shape, computed once per shape:
+        # Rx - FFT function, band slice and power workspace of a [fasts, bins] burst
+        # Tx - indices of the Tx frequencies in a spectrum of specLen points
+        key = (fasts, bins, self.FFT_LEN, specLen)
+        plan = self.plans.get(key)
+
+        if plan is None:
+            plan = {}
+            if bins is not None:
+                if scipyFft is not None:
+                    plan['rfft'] = functools.partial(scipyFft.rfft, n=self.FFT_LEN, axis=-1,
+                                                     workers=self.FFT_WORKERS)
+                else:
+                    plan['rfft'] = functools.partial(np.fft.rfft, n=self.FFT_LEN, axis=-1)
+                plan['band'] = slice(self.freq8GhzIdx, self.freq9_5GhzIdx)
+                if fasts is not None:
+                    plan['power'] = np.empty((fasts, self.FFT_LEN // 2 + 1))
+            if specLen is not None:
+                # spectrum frequency axis
+                freqAxis = np.linspace(self.startFreq_Ghz, self.endFreq_Ghz, specLen)
+                plan['txIdx'] = np.array([np.abs(freqAxis - freq).argmin() for freq in self.txFreqPoints])
+            self.plans[key] = plan
+
+        return plan
 
     # for rx test
+    @traced(category='dsp')
     def snr(self, x):
+        plan = self.plan(*x.shape)
         # real fft for each row (fast signal) (512 points) -> abs -> power 2
-        X = np.fft.rfft(x, n=self.FFT_LEN).__abs__().__pow__(2)
+        X = plan['power']
+        np.abs(plan['rfft'](x), out=X)
+        np.square(X, out=X)
         # mean for each frequnecy
         X_mean = X.mean(axis=0)
 
         # SNR = peak/median
-        noise = np.median(X_mean[self.freq8GhzIdx:self.freq9_5GhzIdx])
+        noise = np.median(X_mean[plan['band']])
         signal = np.max(X_mean)
 
         self.SNR[self.SNRpointer] = signal / noise
 
         self.SNRpointer = (self.SNRpointer + 1) % self.NUMBER_OF_SIGNALS
 
-        # plt.plot(self.freq, 10*np.log10(X_mean))
-        # plt.plot(self.freq[self.freq8GhzIdx:self.freq9_5GhzIdx], 10 * np.log10(noise) * np.ones(self.freq9_5GhzIdx - self.freq8GhzIdx))
-
     # for rx test
     def mean_snr_db(self):
         meanSNR = self.SNR.mean()
 
         return 10 * np.log10(meanSNR)
 
-    # for tx test
-    def peak_power(self, data):
-        return data.max()
+    # for rx test - all the bursts of an antenna at once
+    @traced(category='dsp')
+    def snr_batch(self, x):
+        # x - [bursts, NoFasts, Nbins] array or FrameBlock
+        # returns SNR of every burst (linear, the buffer is reused by the next call) and the mean SNR [dB]
+        if isinstance(x, FrameBlock):
+            x = x.payload
 
-    def measures(self, data):
-        p = []  # all the power measures
+        plan = self.plan(bins=x.shape[-1])
 
-        # spectrum frequency axis
-        freqAxis = np.linspace(self.startFreq_Ghz, self.endFreq_Ghz, data.shape[0])
+        # real fft for each fast of every burst -> abs -> power 2
+        X = plan['rfft'](x)
+        power = self._buffer('power', X.shape)
+        np.abs(X, out=power)
+        np.square(power, out=power)
 
-        # iterate over all the wanted frequencies
-        for freq in self.txFreqPoints:
-            idx = (np.abs(
-                freqAxis - freq)).argmin()  # find the index of freq in vector freqAxis (for 3 freqs in self.txFreqPoints)
+        # mean for each frequency, per burst
+        X_mean = self._buffer('mean', (X.shape[0], X.shape[2]))
+        power.mean(axis=1, out=X_mean)
 
-            p.append(data[idx])
+        # SNR = peak/median
+        noise = np.median(X_mean[:, plan['band']], axis=1)
+        SNR = self._buffer('snr', (X.shape[0],))
+        X_mean.max(axis=1, out=SNR)
+        SNR /= noise
+
+        return SNR, 10 * np.log10(SNR.mean())
+
+    def _buffer(self, name, shape):
+        buffer = self.buffers.get((name, shape))
+        if buffer is None:
+            buffer = np.empty(shape)
+            self.buffers[(name, shape)] = buffer
+
+        return buffer
+
+    # for rx test - incremental SNR with early stop
+    def estimator(self, limitDb=None):
+        return SnrEstimator(limitDb, self.CONFIDENCE, self.MIN_SIGNALS, self.NUMBER_OF_SIGNALS)
+
+    # for settle detection
+    @traced(category='dsp')
+    def spectrum_power(self, x):
+        # mean power [dB] of the fasts inside the Rx band
+        plan = self.plan(*x.shape)
+        X = plan['power']
+        np.abs(plan['rfft'](x), out=X)
+        np.square(X, out=X)
+        X_mean = X.mean(axis=0)
 
-        return p
+        return 10 * np.log10(X_mean[plan['band']].mean())
+
+    # for tx test
+    def peak_power(self, data):
+        return data.max()
+
+    @traced(category='dsp')
+    def measures(self, data):
+        # power at all the wanted frequencies (indices of the spectrum computed once per spectrum length)
+        return list(data[self.plan(specLen=data.shape[0])['txIdx']])
 
     def fail_or_pass(self, test_result):  # not in use!
 
@@ -670,6 +1587,97 @@ class Calculator:
         return result
 
 
+def t_quantile(confidence, df):
+    # two sided Student-t quantile: P(|T| < t) = confidence for df (integer) degrees of freedom.
+    # closed form of the distribution for integer df (Abramowitz & Stegun 26.7.3, 26.7.4), inverted by bisection
+    def probability(t):
+        theta = np.arctan(t / np.sqrt(df))
+        c2 = np.cos(theta) ** 2
+        term = 1.0
+        total = 1.0
+        if df % 2:
+            if df == 1:
+                return 2 * theta / np.pi
+            for k in range(1, (df - 1) // 2):
+                term *= c2 * 2 * k / (2 * k + 1)
+                total += term
+            return 2 / np.pi * (theta + np.sin(theta) * np.cos(theta) * total)
+        for k in range(1, df // 2):
+            term *= c2 * (2 * k - 1) / (2 * k)
+            total += term
+        return np.sin(theta) * total
+
+    low, high = 0.0, 1.0
+    while probability(high) < confidence:
+        high *= 2
+    for i in range(100):
+        mid = (low + high) / 2
+        if probability(mid) < confidence:
+            low = mid
+        else:
+            high = mid
+
+    return high
+
+
+class SnrEstimator:
+    """
+    Running SNR statistics of the bursts of one measurement.
+    Stops as soon as the mean SNR is above or below the limit with the given confidence,
+    so strong (or dead) units need fewer bursts and marginal units still get the full averaging.
+    """
+    def __init__(self, limitDb, confidence, minCount, maxCount):
+        """
+        limitDb: limit to decide against [dB] (None - no early stop)
+        """
+        self.limitDb = limitDb
+        self.confidence = confidence
+        self.quantiles = {}  # degrees of freedom -> Student-t quantile of the confidence
+        self.minCount = minCount
+        self.maxCount = maxCount
+        self.count = 0
+        self.mean = 0.0  # mean linear SNR
+        self.m2 = 0.0  # sum of squared differences from the mean (Welford)
+        self.decision = None  # 'above' or 'below' once the estimate is clearly on one side of the limit
+
+    def update(self, snr):
+        # snr - linear SNR of one burst. returns True when no more bursts are needed
+        self.count += 1
+        delta = snr - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (snr - self.mean)
+
+        if self.limitDb is not None and self.decision is None and self.count >= self.minCount:
+            lower, upper = self.bounds_db()
+            if lower > self.limitDb:
+                self.decision = 'above'
+            elif upper < self.limitDb:
+                self.decision = 'below'
+
+        return self.done()
+
+    def done(self):
+        return self.decision is not None or self.count >= self.maxCount
+
+    def mean_db(self):
+        return 10 * np.log10(self.mean)
+
+    def bounds_db(self):
+        # confidence interval of the mean SNR [dB]
+        if self.count < 2:
+            return -np.inf, np.inf
+
+        # the variance is estimated from the bursts themselves - Student-t with count - 1 degrees of freedom
+        df = self.count - 1
+        if df not in self.quantiles:
+            self.quantiles[df] = t_quantile(self.confidence, df)
+
+        halfWidth = self.quantiles[df] * np.sqrt(self.m2 / df / self.count)
+        lower = 10 * np.log10(self.mean - halfWidth) if self.mean > halfWidth else -np.inf
+
+        return lower, 10 * np.log10(self.mean + halfWidth)
+
+
 # ================== OPEN SOURCE CLASSES ================== #
 
 # this 2 classes are for reading xml files
@@ -0,0 +1,148 @@
+import queue
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock
+
+from common import Calculator
+from tracing import tracer
+
+# ================== worker process side ================== #
+
+_attached = {}  # shared memory name -> (SharedMemory, blocks array)
+_calc = None
+
+
+def _warm_worker(delay):
+    # builds the Calculator of the worker. delay keeps the worker busy, so every worker of the pool is started
+    global _calc
+
+    if _calc is None:
+        tracer.enabled = False  # spans of the worker processes are never exported
+        _calc = Calculator()
+    time.sleep(delay)
+
+
+def _snr_worker(name, shape, dtype, slot):
+    # linear SNR of the burst in the given slot of the shared memory blocks
+    if name not in _attached:
+        # the workers are children of the producer and share its resource tracker (see _start_pool) - the
+        # producer's unlink in close is the only unregister (another one here makes the tracker fail on that unlink)
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+    _warm_worker(0)
+
+    blocks = _attached[name][1]
+    SNR, meanSNR = _calc.snr_batch(blocks[slot:slot + 1])
+
+    return float(SNR[0])
+
+
+# ================== acquisition side ================== #
+
+class DspPipeline:
+    """
+    Producer/consumer split of acquisition and analysis.
+    The acquisition thread copies every burst into a slot of a shared memory block and a worker process runs
+    the Calculator math on it, so the socket is read again at once instead of waiting for the FFT.
+    The number of slots bounds the bursts in flight: when all of them are busy, submit blocks (backpressure)
+    and the stall is counted.
+    Create one pipeline per process and warm_up it before the sweeps - starting the workers takes longer than
+    a measurement. On the bench the FFT of one burst is faster in the acquisition thread (dsp_bursts_per_s)
+    than through the pool (dsp_pool_bursts_per_s), so the sweeps use the pool only when asked to.
+    """
+    SLOTS = 16  # bursts in flight
+    WORKERS = 2
+
+    def __init__(self, slots=None, workers=None):
+        self.slots = self.SLOTS if slots is None else slots
+        self.workers = self.WORKERS if workers is None else workers
+        self.shm = None  # allocated with the first burst (its shape is known only then)
+        self.blocks = None
+        self.pool = None  # started by warm_up (or the first burst)
+        self.free = queue.Queue()
+        self.lock = Lock()
+
+        # backpressure metrics
+        self.submitted = 0
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.stalls = 0  # number of submits which had to wait for a free slot
+        self.stallTime = 0.0  # seconds the acquisition waited for a free slot
+
+    def _start_pool(self):
+        # the resource tracker runs before the workers start, so they inherit it instead of starting their own
+        # (which would unlink the shared memory when a worker exits)
+        if self.pool is None:
+            resource_tracker.ensure_running()
+            self.pool = ProcessPoolExecutor(self.workers)
+
+    def warm_up(self):
+        # starts all the worker processes and builds their Calculator. returns when they are ready
+        with self.lock:
+            self._start_pool()
+
+        futures = [self.pool.submit(_warm_worker, 0.1) for i in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _allocate(self, burst):
+        shape = (self.slots,) + burst.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * burst.itemsize)
+        self.blocks = np.ndarray(shape, dtype=burst.dtype, buffer=self.shm.buf)
+        self._start_pool()
+        for slot in range(self.slots):
+            self.free.put(slot)
+
+    def submit(self, burst):
+        # returns a future of the linear SNR of the burst
+        with self.lock:
+            if self.shm is None:
+                self._allocate(burst)
+
+        if burst.shape != self.blocks.shape[1:]:
+            raise ValueError('burst shape ' + str(burst.shape) + ' != ' + str(self.blocks.shape[1:]))
+
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            slot = self.free.get()
+            with self.lock:
+                self.stalls += 1
+                self.stallTime += time.perf_counter() - start
+
+        # copy out of the receive ring into the shared block
+        self.blocks[slot] = burst
+
+        with self.lock:
+            self.submitted += 1
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+
+        future = self.pool.submit(_snr_worker, self.shm.name, self.blocks.shape, self.blocks.dtype.str, slot)
+        future.add_done_callback(lambda f: self._release(slot))
+
+        return future
+
+    def _release(self, slot):
+        with self.lock:
+            self.inFlight -= 1
+        self.free.put(slot)
+
+    def metrics(self):
+        with self.lock:
+            return {'submitted': self.submitted, 'inFlight': self.inFlight, 'maxInFlight': self.maxInFlight,
+                    'stalls': self.stalls, 'stallTime': self.stallTime}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.shm is not None:
+            self.blocks = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
@@ -3,172 +3,158 @@ import sys
 import importlib
 import common
 importlib.reload(common)
-import numpy as np
+import sweep
+import capture
+import transport
+from dsp import DspPipeline
+from tracing import tracer
 from threading import Thread
 import os
-import pandas as pd
-
-
-
-
-
 
 TESTER_IP = '192.168.1.99'
-# Create rsa driver and
-rsa = common.RSaDriver()
-# Create Tester driver
-tester = common.Imx6Controller(IP=TESTER_IP, mode='TESTER')
-tester.load_params()
-# create DUT driver
-
-# find DUT IP address by MAC ADDRESS
-common.update_arp('192.168.1')
-code = False
-
-while not code:
-    mac = input("Please insert device MAC Address (type 0 for EXIT):")
-    code = common.check_user_input(mac, 'MAC')
-
-# mac = 'd0:63:b4:02:86:27'
-DUT_IP = common.find_ip_by_mac(mac.lower().replace(':', '-'))
-
-# DUT_IP = '192.168.1.101'
-
-dut = common.Imx6Controller(IP=DUT_IP, mode='DUT')
-dut.load_params()
-
-common.kill_novelda_app(DUT_IP, 'root', 'E5#C4*TnzRog')
-common.kill_novelda_app(TESTER_IP, 'root', 'tester')
-
-# get return value
-mac = [None]
-thread_dut = Thread(target=common.run_imx_app, kwargs=dict(mode='DUT', ip=DUT_IP, username='root', password='E5#C4*TnzRog', mac=mac))
-thread_tester = Thread(target=common.run_imx_app, kwargs=dict(mode='TESTER', ip=TESTER_IP, username='root', password='tester', mac=[]))
-
-thread_dut.start()
-thread_tester.start()
-time.sleep(2)
-# Check connectivity
-connectionThreads = [Thread(target=rsa.connect), Thread(target=tester.connect), Thread(target=dut.connect)]
-
-for t in connectionThreads:
-    t.start()
-for t in connectionThreads:
-    t.join()
-
-mac = mac[0]
-
-if not rsa.isConnected or not dut.isConnected or not tester.isConnected:
-    input("Press 'ENTER' to exit...")
-    sys.exit()
-
-code = False
-
-# user input - SERIAL NUMBER
-while not code:
-
-    sn = input("Please insert device serial number (type 0 for EXIT):")
-    code = common.check_user_input(sn, 'SN')
-# basic config for rsa
-rsa.config()
-# create calculator class
-calc = common.Calculator()
-# create excel handler class
-exHdlr = common.ExcelHandler()
-
-dutRev = '3.1'
-dutSerialNumber = sn
-deviceMAC = mac
-deviceInfo = [dutRev, dutSerialNumber, mac["eth0"], mac["wlan0"]]
-
-exHdlr.set_device_info(deviceInfo)
-
-# load tx setup
-rsa.load_setup('tx')
-# change to full transmit gain
-dut.change_transmition_gain(3)
-
-
-for i in range(8):
-    rsa.refresh_trace()
-    tester.switch('tx', i)
-    time.sleep(0.1)
-
-    # transmit for long time (3sec)
-    for n in range(50):
-        dut.switch('tx', i)
-
-    spectrum = rsa.get_spectrum_curve()
-    p = calc.measures(spectrum)
-
-    exHdlr.txDf["8.3GHz [dBm]"][i] = p[0]
-    exHdlr.txDf["8.58GHz [dBm]"][i] = p[1]
-    exHdlr.txDf["8.9GHz [dBm]"][i] = p[2]
-    print("### Done Tx #" + str(i), end='\r')
-
-# clear buffer
-dut.clear_buffer()
-# load tx setup
-rsa.load_setup('rx')
-# change to full transmit gain
-dut.change_transmition_gain(0)
 
-for i in range(32):
-    # SNR test
-    tester.switch('rx', i)
-    time.sleep(0.1)
-    # transmit for 1 second
-    for n in range(10):
-        data = dut.switch('rx', i)
-        calc.snr(data)
 
-    SNR = calc.mean_snr_db()
+def run_tx(tester, dut, rsa, calc, exHdlr):
+    # load tx setup
+    rsa.load_setup('tx')
+    # change to full transmit gain
+    dut.change_transmition_gain(3)
 
-    exHdlr.rxDf["SNR [dB]"][i] = SNR
+    txSweep = sweep.TxSweep(tester, dut, rsa, calc, exHdlr,
+                            callback=lambda i: print("### Done Tx #" + str(i), end='\r'))
+    txSweep.run()
+    print(txSweep.report())
+
+    # clear buffer
+    dut.clear_buffer()
+
+
+def run_rx(tester, dut, rsa, calc, exHdlr, dsp=None):
+    # the Rx sweep does not use the RSA (the tracking generator of the rx setup is off), it keeps the tx setup
+    # change to full transmit gain
+    dut.change_transmition_gain(0)
+
+    # dsp - DspPipeline for the SNR math (in this thread if None)
+    rxSweep = sweep.RxSweep(tester, dut, calc, exHdlr, dsp=dsp,
+                            callback=lambda i: print("### Done Rx #" + str(i), end='\r'))
+    rxSweep.run()
+    print(rxSweep.report())
+
+
+def main(record=False, useDsp=False):
+    # record - capture the raw bursts and spectra of the unit (test/<sn>.cap, about 35 MB) for capture.Replay
+    # useDsp - SNR math in DspPipeline worker processes (slower than in the acquisition thread on the bench)
+    # Create rsa driver and
+    rsa = common.RSaDriver()
+    # Create Tester driver
+    tester = common.Imx6Controller(IP=TESTER_IP, mode='TESTER')
+    tester.load_params()
+    # create DUT driver
+
+    # find DUT IP address by MAC ADDRESS
+    code = False
 
-    exHdlr.save()
+    while not code:
+        mac = input("Please insert device MAC Address (type 0 for EXIT):")
+        code = common.check_user_input(mac, 'MAC')
 
-    # cross SNR test
-    tester.switch('rx', (i+1) % 32)
-    time.sleep(0.1)
-    # transmit for 1 second
-    for n in range(10):
-        data = dut.switch('rx', i)
-        calc.snr(data)
+    # mac = 'd0:63:b4:02:86:27'
+    DUT_IP, discoveryTime = common.discover_ip_by_mac('192.168.1', mac.lower().replace(':', '-'))
 
-    SNR = calc.mean_snr_db()
+    # DUT_IP = '192.168.1.101'
 
-    exHdlr.rxDf["Cross Antenna loss [dB]"][i] = exHdlr.rxDf["SNR [dB]"][i] - SNR
+    dut = common.Imx6Controller(IP=DUT_IP, mode='DUT')
+    dut.load_params()
 
-    exHdlr.save()
+    common.kill_novelda_app(DUT_IP, 'root', 'E5#C4*TnzRog')
+    common.kill_novelda_app(TESTER_IP, 'root', 'tester')
 
-    print("### Done Rx #"+str(i), end='\r')
+    # get return value
+    mac = [None]
+    thread_dut = Thread(target=common.run_imx_app, kwargs=dict(mode='DUT', ip=DUT_IP, username='root', password='E5#C4*TnzRog', mac=mac))
+    thread_tester = Thread(target=common.run_imx_app, kwargs=dict(mode='TESTER', ip=TESTER_IP, username='root', password='tester', mac=[]))
 
-# REPORT
+    thread_dut.start()
+    thread_tester.start()
+    time.sleep(2)
+    # Check connectivity - RSA, tester and DUT at the same time on one event loop
+    transport.run(transport.connect_all(rsa, tester, dut))
 
-time.sleep(1)
+    mac = mac[0]
 
-txRes = exHdlr.txDf > exHdlr.txRef
-rxRes = exHdlr.rxDf > exHdlr.rxRef
+    if not rsa.isConnected or not dut.isConnected or not tester.isConnected:
+        input("Press 'ENTER' to exit...")
+        sys.exit()
 
-txRes = txRes.drop(columns="Sector + Tx bit")
-rxRes = rxRes.drop(columns="Sector")
+    code = False
 
-txFalses = 1 - txRes.values
-rxFalses = 1 - rxRes.values
+    # user input - SERIAL NUMBER
+    while not code:
 
-txNotPassed = np.sum(txFalses)
-rxNotPassed = np.sum(rxFalses)
-# save the final excel. maor addition
-exHdlr.final_excel((txNotPassed or rxNotPassed), sn, exHdlr.tx_test_excel(sn), exHdlr.rx_test_excel(sn))
+        sn = input("Please insert device serial number (type 0 for EXIT):")
+        code = common.check_user_input(sn, 'SN')
+    tracer.set_dut(sn)
+    # basic config for rsa
+    rsa.config()
+    # create calculator class
+    calc = common.Calculator()
+    # create excel handler class
+    exHdlr = common.ExcelHandler()
 
-if txNotPassed or rxNotPassed:
-    print('Device test results' + str(sn) + ':   Failed')
-else:
-    print('Device test results' + str(sn) + ':   Pass')
+    # an earlier run of this unit was interrupted - save what it measured or start over
+    if exHdlr.leftover_journal(sn) is not None:
+        answer = input("Found an interrupted test of " + sn + ". Recover its results (r) or run a new test (n)?")
+        if answer.strip().lower() == 'r':
+            print('Recovered ' + str(exHdlr.recover(sn)) + ' measurements to ' + exHdlr.reportPath)
+            input("Press 'ENTER' to exit...")
+            sys.exit()
 
-print("The test was completed successfully")
+    dutRev = '3.1'
+    dutSerialNumber = sn
+    deviceMAC = mac
+    deviceInfo = [dutRev, dutSerialNumber, mac["eth0"], mac["wlan0"]]
+
+    exHdlr.set_device_info(deviceInfo)
+
+    # raw bursts and spectra of the unit, for offline re-scoring (capture.Replay)
+    if record:
+        dut.recorder = capture.CaptureWriter(os.path.join('test', sn + '.cap'), dut.params, {'sn': sn, 'mac': mac})
 
+    # the workers are started before the sweeps, not with the first Rx burst
+    dsp = DspPipeline() if useDsp else None
+    try:
+        if dsp is not None:
+            dsp.warm_up()
+        run_tx(tester, dut, rsa, calc, exHdlr)
+        run_rx(tester, dut, rsa, calc, exHdlr, dsp)
+    finally:
+        if dsp is not None:
+            dsp.close()
+
+    # REPORT
+
+    time.sleep(1)
+
+    if dut.recorder is not None:
+        dut.recorder.close()
+
+    # pass/fail of all the measurements (also used for the styling of the report)
+    notPassed = exHdlr.evaluate()
+    # save the final excel. maor addition
+    exHdlr.final_excel(notPassed, sn, exHdlr.tx_test_excel(sn), exHdlr.rx_test_excel(sn))
+
+    if notPassed:
+        print('Device test results' + str(sn) + ':   Failed')
+    else:
+        print('Device test results' + str(sn) + ':   Pass')
 
+    # where the cycle time went
+    print(tracer.report())
+    tracer.export_chrome(os.path.join('test', 'trace_' + sn + '.json'))
 
+    print("The test was completed successfully")
 
+
+# the DSP worker processes import this module again (spawn) - the test runs only when started as a script
+if __name__ == '__main__':
+    main(record='--capture' in sys.argv[1:], useDsp='--dsp' in sys.argv[1:])
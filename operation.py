@@ -1,6 +1,7 @@
 from common import Imx6Controller, run_imx_app, kill_novelda_app, kill_echosystem_app, RSaDriver
 from threading import Thread
 import time
+import transport
 
 
 class DeviceController(Imx6Controller):
@@ -32,17 +33,13 @@ class DeviceController(Imx6Controller):
 
 def connect_to_tester(IP, *args):
     tester = DeviceController(IP, 'TESTER', *args)
-    connection_thread = Thread(target=tester.connect)
-    connection_thread.start()
-    connection_thread.join()
+    transport.run(transport.connect_all(None, tester))
     return tester
 
 
 def connect_to_dut(IP, *args):
     dut = DeviceController(IP, 'DUT', *args)
-    connection_thread = Thread(target=dut.connect)
-    connection_thread.start()
-    connection_thread.join()
+    transport.run(transport.connect_all(None, dut))
     return dut
 
 
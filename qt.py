@@ -1,4 +1,3 @@
-import numpy as np
 import qrc_resources
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import Qt, QSize, pyqtSignal, pyqtSlot, QTimer
@@ -16,6 +15,7 @@ from threading import Thread
 
 from common import find_ip_by_mac, Calculator, ExcelHandler
 from operation import connect_to_tester, connect_to_dut, connect_to_rsa
+from sweep import TxSweep, RxSweep
 from validations import validate_ip, validate_sn
 
 
@@ -363,28 +363,13 @@ class FlowControl(QtCore.QThread):
         self.main_window.progress_bar.setMaximum(8)
         self.main_window.progress_bar.setValue(0)
         self.main_window.progress_bar.text('Tx Test')
-        for i in range(8):
-            self.rsa.refresh_trace()
-            self.tester.switch('tx', i)
-            time.sleep(0.1)
-
-            # transmit for long time (3sec)
-            for n in range(50):
-                self.dut.switch('tx', i)
-
-            spectrum = self.rsa.get_spectrum_curve()
-            p = calc.measures(spectrum)
-
-            excel_handler.txDf["8.3GHz [dBm]"][i] = p[0]
-            excel_handler.txDf["8.58GHz [dBm]"][i] = p[1]
-            excel_handler.txDf["8.9GHz [dBm]"][i] = p[2]
-            self.main_window.statusbar.showMessage("### Done Tx #" + str(i))
-            self.main_window.progress_bar.setValue(i + 1)
+        tx_sweep = TxSweep(self.tester, self.dut, self.rsa, calc, excel_handler, callback=self._tx_done)
+        tx_sweep.run()
+        print(tx_sweep.report())
 
         # clear buffer
         self.dut.clear_buffer()
-        # load tx setup
-        self.rsa.load_setup('rx')
+        # the Rx sweep does not use the RSA, it keeps the tx setup
         # change to full transmit gain
         self.dut.change_transmition_gain(0)
         self.main_window.progress_bar.setMinimum(0)
@@ -392,62 +377,34 @@ class FlowControl(QtCore.QThread):
         self.main_window.progress_bar.setValue(0)
         self.main_window.progress_bar.text('Rx Test')
 
-        for i in range(32):
-            # SNR test
-            self.tester.switch('rx', i)
-            time.sleep(0.1)
-            # transmit for 1 second
-            for n in range(10):
-                data = self.dut.switch('rx', i)
-                calc.snr(data)
-
-            SNR = calc.mean_snr_db()
-
-            excel_handler.rxDf["SNR [dB]"][i] = SNR
-
-            excel_handler.save()
-
-            # cross SNR test
-            self.tester.switch('rx', (i + 1) % 32)
-            time.sleep(0.1)
-            # transmit for 1 second
-            for n in range(10):
-                data = self.dut.switch('rx', i)
-                calc.snr(data)
-
-            SNR = calc.mean_snr_db()
-
-            excel_handler.rxDf["Cross Antenna loss [dB]"][i] = excel_handler.rxDf["SNR [dB]"][i] - SNR
-
-            excel_handler.save()
-            self.main_window.progress_bar.setValue(i + 1)
-            self.main_window.statusbar.showMessage("### Done Rx #" + str(i))
+        rx_sweep = RxSweep(self.tester, self.dut, calc, excel_handler, callback=self._rx_done)
+        rx_sweep.run()
+        print(rx_sweep.report())
 
         # REPORT
         time.sleep(1)
 
-        tx_res = excel_handler.txDf > excel_handler.txRef
-        rx_res = excel_handler.rxDf > excel_handler.rxRef
-
-        tx_res = tx_res.drop(columns="Sector + Tx bit")
-        rx_res = rx_res.drop(columns="Sector")
-
-        tx_false = 1 - tx_res.values
-        rx_false = 1 - rx_res.values
-
-        tx_not_passed = np.sum(tx_false)
-        rx_not_passed = np.sum(rx_false)
+        # pass/fail of all the measurements (also used for the styling of the report)
+        not_passed = excel_handler.evaluate()
 
         # save the final excel.
-        excel_handler.final_excel((tx_not_passed or rx_not_passed),
+        excel_handler.final_excel(not_passed,
                                   self.sn, excel_handler.tx_test_excel(self.sn),
                                   excel_handler.rx_test_excel(self.sn))
 
-        if tx_not_passed or rx_not_passed:
+        if not_passed:
             self.state.emit(messages['failed'])
         else:
             self.state.emit(messages['passed'])
 
+    def _tx_done(self, i):
+        self.main_window.statusbar.showMessage("### Done Tx #" + str(i))
+        self.main_window.progress_bar.setValue(i + 1)
+
+    def _rx_done(self, i):
+        self.main_window.progress_bar.setValue(i + 1)
+        self.main_window.statusbar.showMessage("### Done Rx #" + str(i))
+
     def _get_sn(self):
         sn_dialog = SerialNumberDialog()
         sn_dialog.accept.connect(self._valid_sn)
@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+from threading import Thread
+
+import capture
+import common
+from operation import connect_to_tester, connect_to_dut
+from dsp import DspPipeline
+from sweep import ResourceScheduler, TxSweep, RxSweep
+from tracing import tracer
+
+
+class DutJob(Thread):
+    """
+    Full test of one DUT of a station: its own socket, Calculator and ExcelHandler,
+    sharing the tester and the RSA with the other DUTs through the station scheduler.
+    """
+    def __init__(self, station, IP, sn, phases=('tx', 'rx'), rev='3.1'):
+        """
+        phases: order of the Tx and Rx phases. DUTs started with different orders overlap better -
+        one uses the tester for Rx while another one waits for the RSA in Tx
+        """
+        super().__init__(name='DUT ' + sn)
+        self.station = station
+        self.IP = IP
+        self.sn = sn
+        self.phases = phases
+        self.rev = rev
+        self.dut = None
+        self.calc = common.Calculator()
+        self.excel_handler = common.ExcelHandler()
+        self.notPassed = None  # number of failed measurements when done
+        self.error = None
+        self.total = 0
+
+    def run(self):
+        tracer.set_dut(self.sn)
+        start = time.perf_counter()
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+            print('### DUT ' + self.sn + ': ' + repr(e))
+        finally:
+            if self.dut is not None and self.dut.recorder is not None:
+                self.dut.recorder.close()
+        self.total = time.perf_counter() - start
+
+    def _run(self):
+        self.dut = connect_to_dut(self.IP)
+        if not self.dut.isConnected:
+            raise RuntimeError('DUT is not connected')
+
+        mac = self.dut.mac[0] or {'eth0': None, 'wlan0': None}
+        self.excel_handler.set_device_info([self.rev, self.sn, str(mac['eth0']), str(mac['wlan0'])])
+        if self.station.record:
+            self.dut.recorder = capture.CaptureWriter(os.path.join('test', self.sn + '.cap'), self.dut.params,
+                                                      {'sn': self.sn, 'mac': mac})
+
+        scheduler = self.station.scheduler
+        for phase in self.phases:
+            if phase == 'tx':
+                # change to full transmit gain
+                self.dut.change_transmition_gain(3)
+                TxSweep(self.station.tester, self.dut, self.station.rsa, self.calc, self.excel_handler,
+                        scheduler=scheduler).run()
+                self.dut.clear_buffer()
+            else:
+                self.dut.change_transmition_gain(0)
+                RxSweep(self.station.tester, self.dut, self.calc, self.excel_handler, scheduler=scheduler,
+                        dsp=self.station.dsp).run()
+
+        self.notPassed = self.excel_handler.evaluate()
+        self.excel_handler.final_excel(self.notPassed, self.sn, self.excel_handler.tx_test_excel(self.sn),
+                                       self.excel_handler.rx_test_excel(self.sn))
+
+
+class Station:
+    """
+    Tests several DUTs at the same time against one tester and one RSA.
+    Every DUT runs in its own thread; the tester antenna switch and the RSA are shared with a ResourceScheduler.
+    The RSA stays in the Tx setup (the Rx phase does not use it).
+    The Rx SNR is computed in the DUT threads, or by one DspPipeline (worker processes) shared by all the DUTs.
+    """
+    def __init__(self, tester, rsa, dsp=None, record=False, alternate=False):
+        """
+        dsp: DspPipeline for the Rx SNR of all the DUTs, started before the DUTs and closed by run
+        record: capture the raw data of every DUT (test/<sn>.cap, tens of MB per unit) for capture.Replay
+        alternate: run every second DUT Rx first. the DUTs overlap better, but the procedure differs per DUT
+        """
+        self.tester = tester
+        self.rsa = rsa
+        self.scheduler = ResourceScheduler()
+        self.dsp = dsp
+        self.record = record
+        self.alternate = alternate
+        self.jobs = []
+
+    def add_dut(self, IP, sn):
+        # with alternate, the DUTs do not all wait for the RSA at the same time
+        phases = ('rx', 'tx') if self.alternate and len(self.jobs) % 2 else ('tx', 'rx')
+        job = DutJob(self, IP, sn, phases)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        # returns serial number -> number of failed measurements (None if the test did not complete)
+        self.rsa.load_setup('tx')
+
+        try:
+            if self.dsp is not None:
+                self.dsp.warm_up()
+            for job in self.jobs:
+                job.start()
+            for job in self.jobs:
+                job.join()
+        finally:
+            if self.dsp is not None:
+                self.dsp.close()
+
+        # span timeline of every DUT
+        for job in self.jobs:
+            tracer.export_chrome(os.path.join('test', 'trace_' + job.sn + '.json'), dut=job.sn)
+
+        return {job.sn: job.notPassed for job in self.jobs}
+
+    def report(self):
+        lines = []
+        for job in self.jobs:
+            if job.notPassed is None:
+                result = 'Error'
+            else:
+                result = 'Failed' if job.notPassed else 'Pass'
+            lines.append('%s: %s (%.1f s)' % (job.sn, result, job.total))
+        for name, waits in self.scheduler.waits.items():
+            lines.append('%s wait: total %.2f s over %d uses' % (name, sum(waits), len(waits)))
+        if self.dsp is not None:
+            m = self.dsp.metrics()
+            lines.append('dsp: %d bursts, max %d in flight, %d stalls (%.3f s)' % (
+                m['submitted'], m['maxInFlight'], m['stalls'], m['stallTime']))
+
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    TESTER_IP = '192.168.1.99'
+
+    rsa = common.RSaDriver()
+    if not rsa.connect():
+        input("Press 'ENTER' to exit...")
+        sys.exit()
+    rsa.config()
+
+    tester = connect_to_tester(TESTER_IP)
+    if not tester.isConnected:
+        input("Press 'ENTER' to exit...")
+        sys.exit()
+
+    station = Station(tester, rsa, dsp=DspPipeline() if '--dsp' in sys.argv[1:] else None,
+                      record='--capture' in sys.argv[1:])
+
+    while True:
+        mac = input("Please insert device MAC Address (empty line to start, 0 for EXIT):")
+        if mac == '':
+            break
+        if not common.check_user_input(mac, 'MAC'):
+            continue
+
+        code = False
+        while not code:
+            sn = input("Please insert device serial number (type 0 for EXIT):")
+            code = common.check_user_input(sn, 'SN')
+
+        DUT_IP, discoveryTime = common.discover_ip_by_mac('192.168.1', mac.lower().replace(':', '-'))
+        if DUT_IP:
+            station.add_dut(DUT_IP, sn)
+
+    station.run()
+    print(station.report())
+    print(tracer.report())
@@ -0,0 +1,433 @@
+import time
+import numpy as np
+from contextlib import contextmanager
+from threading import Lock
+
+from common import FrameBlock
+
+
+class ResourceScheduler:
+    """
+    Locks of the resources shared by the DUTs of a station (tester antenna switch, RSA).
+    Resources are always taken in ORDER (tester before RSA) so DUTs sharing them cannot deadlock.
+    A sweep which runs alone gets its own scheduler and never waits.
+    """
+    ORDER = ['tester', 'rsa']
+
+    def __init__(self):
+        self.locks = {name: Lock() for name in self.ORDER}
+        self.waits = {name: [] for name in self.ORDER}  # seconds waited for every acquire
+
+    def acquire(self, name):
+        start = time.perf_counter()
+        self.locks[name].acquire()
+        self.waits[name].append(time.perf_counter() - start)
+
+    def release(self, name):
+        # may be called from another thread than acquire (e.g. the RSA worker of TxSweep)
+        self.locks[name].release()
+
+    @contextmanager
+    def hold(self, *names):
+        names = sorted(names, key=self.ORDER.index)
+        for name in names:
+            self.acquire(name)
+        try:
+            yield
+        finally:
+            for name in reversed(names):
+                self.release(name)
+
+
+class TxSweep:
+    """
+    Pipelined Tx sweep over the 8 Tx sectors.
+    The RSA is driven through the command queue of the driver (one worker thread, so its commands keep their
+    order). Only the fetch runs there, so the tester switch of the next sector runs while the spectrum is
+    fetched, and the spectrum is measured by the sweep thread while the next sector settles:
+
+        main:   switch i | clear i | settle, measure i-1 | burst i | switch i+1 | clear i+1 | settle, measure i
+        queue:                                                     | fetch i    |
+
+    The RSA trace is cleared only after the previous spectrum was fetched, so the measurement is the same
+    as in the sequential sweep.
+    The RSA is held from the clear to the fetch. With a shared scheduler (station) the tester is held for as long
+    too, so the bursts of another DUT cannot reach the MaxHold trace; alone, it is released after the burst.
+    """
+    SECTORS = 8
+    BURSTS = 50  # DUT switches per sector (transmit for long time)
+    SETTLE_TIME = 0.1  # seconds to wait after the tester switch
+
+    def __init__(self, tester, dut, rsa, calc, excel_handler, callback=None, scheduler=None):
+        """
+        callback: called with the sector number when its measurement is done
+        scheduler: ResourceScheduler shared with other DUTs (own one if None)
+        """
+        self.tester = tester
+        self.dut = dut
+        self.rsa = rsa
+        self.calc = calc
+        self.excel_handler = excel_handler
+        self.callback = callback
+        self.scheduler = ResourceScheduler() if scheduler is None else scheduler
+        self.shared = scheduler is not None
+        self.timings = {}  # stage name -> list of durations [s]
+        self.total = 0
+
+    def run(self):
+        self.timings = {stage: [] for stage in ['switch', 'clear', 'settle', 'burst', 'fetch', 'measure']}
+        start = time.perf_counter()
+        fetch = None  # future of (sector, spectrum) of the previous sector
+
+        for i in range(self.SECTORS):
+            t = time.perf_counter()
+            # waits for the fetch of the previous sector when shared. released by _fetch then
+            self.scheduler.acquire('tester')
+            held = ['tester']
+            try:
+                self.tester.switch('tx', i)
+                t = self._lap('switch', t)
+
+                # waits for the fetch of the previous sector. the RSA is released by _fetch
+                self.scheduler.acquire('rsa')
+                held.append('rsa')
+                self.rsa.queue.submit(self.rsa.refresh_trace).result()
+                t = self._lap('clear', t)
+
+                # the previous spectrum was fetched before the clear, it is measured within the settle time
+                if fetch is not None:
+                    self._measure(*fetch.result())
+                time.sleep(max(0, t + self.SETTLE_TIME - time.perf_counter()))
+                t = self._lap('settle', t)
+
+                for n in range(self.BURSTS):
+                    self.dut.switch('tx', i)
+                self._lap('burst', t)
+
+                release = held if self.shared else ['rsa']
+                fetch = self.rsa.queue.submit(self._fetch, i, release)
+                held = [name for name in held if name not in release]
+            finally:
+                for name in reversed(held):
+                    self.scheduler.release(name)
+
+        self._measure(*fetch.result())
+
+        self.total = time.perf_counter() - start
+
+        return self.excel_handler.txDf
+
+    def _fetch(self, i, release):
+        # on the RSA queue. release - the resources held for sector i, released as soon as its trace is fetched
+        t = time.perf_counter()
+        try:
+            spectrum = self.rsa.get_spectrum_curve()
+        finally:
+            for name in reversed(release):
+                self.scheduler.release(name)
+        self._lap('fetch', t)
+
+        return i, spectrum
+
+    def _measure(self, i, spectrum):
+        # the spectrum is a trace buffer of the driver, valid until the next fetch but one
+        t = time.perf_counter()
+        if self.dut.recorder is not None:
+            self.dut.recorder.write(b'RSA ', 'tx', i, spectrum)
+
+        p = self.calc.measures(spectrum)
+
+        self.excel_handler.record('tx', i, "8.3GHz [dBm]", p[0])
+        self.excel_handler.record('tx', i, "8.58GHz [dBm]", p[1])
+        self.excel_handler.record('tx', i, "8.9GHz [dBm]", p[2])
+        self._lap('measure', t)
+
+        if self.callback is not None:
+            self.callback(i)
+
+    def _lap(self, stage, start):
+        now = time.perf_counter()
+        self.timings[stage].append(now - start)
+        return now
+
+    def report(self):
+        # per stage timings summary
+        lines = ['Tx sweep: %.3f s' % self.total]
+        for stage, durations in self.timings.items():
+            if durations:
+                lines.append('  %-8s total %.3f s, mean %.1f ms, max %.1f ms' % (
+                    stage, sum(durations), 1000 * sum(durations) / len(durations), 1000 * max(durations)))
+
+        return '\n'.join(lines)
+
+
+class SettleDetector:
+    """
+    Replaces the fixed wait after a tester switch.
+    DUT bursts are read right after the switch and the measurement starts as soon as two consecutive bursts have
+    the same spectrum power (within TOLERANCE_DB). The stable bursts are handed back to be used for the
+    measurement, so a unit which settles at once does not wait at all.
+    """
+    TOLERANCE_DB = 0.5
+    MAX_WAIT = 0.5  # seconds. after that the measurement starts anyway
+
+    def __init__(self, dut, calc, toleranceDb=None, maxWait=None):
+        self.dut = dut
+        self.calc = calc
+        self.toleranceDb = self.TOLERANCE_DB if toleranceDb is None else toleranceDb
+        self.maxWait = self.MAX_WAIT if maxWait is None else maxWait
+        self.settleTimes = {}  # key (e.g. antenna) -> seconds from the switch until the signal was stable
+
+    def wait(self, testType, ant, key=None):
+        # returns the stable bursts (at most 2, valid until the DUT ring wraps)
+        if key is None:
+            key = (testType, ant)
+
+        start = time.perf_counter()
+        previous = None  # (burst, power, start time of the burst)
+
+        while True:
+            burstStart = time.perf_counter()
+            data = self.dut.switch(testType, ant)
+            now = time.perf_counter()
+
+            if not isinstance(data, np.ndarray):  # timeout
+                previous = None
+            else:
+                power = self.calc.spectrum_power(data)
+
+                if previous is not None and abs(power - previous[1]) <= self.toleranceDb:
+                    self.settleTimes[key] = previous[2] - start
+                    return [previous[0], data]
+
+                previous = (data, power, burstStart)
+
+            if now - start > self.maxWait:
+                print('Signal did not settle for ' + str(key))
+                self.settleTimes[key] = now - start
+                return [] if previous is None else [previous[0]]
+
+
+class RxSweep:
+    """
+    Rx sweep over the 32 antennas: SNR with the tester on the same antenna, and cross antenna loss with the
+    tester on the next antenna. The fixed wait after every tester switch is replaced by SettleDetector.
+    With EARLY_STOP, a measurement stops taking bursts as soon as it is clearly above or below its rxRef limit.
+    With a DspPipeline, the SNR of every burst is computed in a worker process while the next one is received.
+    With SHARE_TESTER, the measurements are reordered so the tester switches once per antenna instead of twice.
+    """
+    ANTENNAS = 32
+    EARLY_STOP = True
+    SHARE_TESTER = True  # cross SNR of antenna i - 1 and SNR of antenna i at the same tester position
+
+    def __init__(self, tester, dut, calc, excel_handler, callback=None, settle=None, scheduler=None, dsp=None):
+        """
+        callback: called with the antenna number when its measurements are done
+        settle: SettleDetector to use (default one if None)
+        scheduler: ResourceScheduler shared with other DUTs (own one if None)
+        dsp: DspPipeline for the SNR calculation (computed in this thread if None)
+        """
+        self.tester = tester
+        self.dut = dut
+        self.calc = calc
+        self.excel_handler = excel_handler
+        self.callback = callback
+        self.settle = SettleDetector(dut, calc) if settle is None else settle
+        self.scheduler = ResourceScheduler() if scheduler is None else scheduler
+        self.dsp = dsp
+        self.bursts = None  # FrameBlock of the bursts of one measurement, stacked for Calculator.snr_batch
+        self.burstCounts = {}  # key -> number of bursts the measurement took
+        self.testerSwitches = 0
+        self.total = 0
+
+    def run(self):
+        start = time.perf_counter()
+        self.testerSwitches = 0
+
+        if self.SHARE_TESTER:
+            self._run_shared()
+        else:
+            self._run_pairs()
+
+        self.total = time.perf_counter() - start
+
+        return self.excel_handler.rxDf
+
+    def _run_pairs(self):
+        # two tester switches per antenna
+        rxDf = self.excel_handler.rxDf
+        rxRef = self.excel_handler.rxRef
+
+        for i in range(self.ANTENNAS):
+            # SNR test
+            with self.scheduler.hold('tester'):
+                self._switch_tester(i)
+                SNR = self._measure_snr(i, ('snr', i), rxRef["SNR [dB]"][i])
+
+            self.excel_handler.record('rx', i, "SNR [dB]", SNR)
+
+            # cross SNR test. the loss passes when the cross SNR is below SNR - loss limit
+            with self.scheduler.hold('tester'):
+                self._switch_tester((i + 1) % self.ANTENNAS)
+                SNR = self._measure_snr(i, ('cross', i), rxDf["SNR [dB]"][i] - rxRef["Cross Antenna loss [dB]"][i])
+
+            self._record_cross(i, SNR)
+
+    def _run_shared(self):
+        # one tester switch per antenna: with the tester on antenna p, the DUT takes the cross SNR of antenna p - 1
+        # and then the SNR of antenna p. the cross SNR of the last antenna is taken at position 0, before the SNR
+        # it is compared to is known, so it takes all the bursts (no early stop)
+        rxDf = self.excel_handler.rxDf
+        rxRef = self.excel_handler.rxRef
+        last = self.ANTENNAS - 1
+        crossLast = None
+
+        for p in range(self.ANTENNAS):
+            with self.scheduler.hold('tester'):
+                self._switch_tester(p)
+
+                if p == 0:
+                    crossLast = self._measure_snr(last, ('cross', last), None)
+                else:
+                    cross = self._measure_snr(p - 1, ('cross', p - 1),
+                                              rxDf["SNR [dB]"][p - 1] - rxRef["Cross Antenna loss [dB]"][p - 1])
+
+                SNR = self._measure_snr(p, ('snr', p), rxRef["SNR [dB]"][p])
+
+            self.excel_handler.record('rx', p, "SNR [dB]", SNR)
+            if p > 0:
+                self._record_cross(p - 1, cross)
+
+        self._record_cross(last, crossLast)
+
+    def _switch_tester(self, ant):
+        self.tester.switch('rx', ant)
+        self.testerSwitches += 1
+
+    def _record_cross(self, i, SNR):
+        rxDf = self.excel_handler.rxDf
+        self.excel_handler.record('rx', i, "Cross Antenna loss [dB]", rxDf["SNR [dB]"][i] - SNR)
+
+        if self.callback is not None:
+            self.callback(i)
+
+    def _measure_snr(self, ant, key, limitDb):
+        # key - (measurement, antenna), also the context of the captured bursts.
+        # only the bursts which feed the measurement are captured (not the ones before the signal settled)
+        stable = self.settle.wait('rx', ant, key)
+
+        recorder = self.dut.recorder
+        if recorder is None:
+            return self._measure(ant, key, limitDb, stable)
+
+        for data in stable:
+            recorder.write(b'DUT ', key[0], key[1], data)
+        recorder.context = key
+        try:
+            return self._measure(ant, key, limitDb, stable)
+        finally:
+            recorder.context = None
+
+    def _measure(self, ant, key, limitDb, stable):
+        # transmit for up to 1 second (the stable bursts from the settle detection are part of it)
+        if self.dsp is not None:
+            return self._measure_snr_offloaded(ant, key, limitDb, stable)
+
+        for n, data in enumerate(stable):
+            self._store(n, data)
+        n = len(stable)
+
+        # a burst which could not be received (0) takes its turn but is not measured
+        if not self.EARLY_STOP:
+            for attempt in range(n, self.calc.NUMBER_OF_SIGNALS):
+                data = self.dut.switch('rx', ant)
+                if isinstance(data, np.ndarray):
+                    self._store(n, data)
+                    n += 1
+
+            # all the bursts in one vectorized pass
+            self.burstCounts[key] = self.calc.NUMBER_OF_SIGNALS
+            return self.calc.snr_batch(self.bursts.payload[:n])[1]
+
+        estimator = self.calc.estimator(limitDb)
+        if n:
+            for SNR in self.calc.snr_batch(self.bursts.payload[:n])[0]:
+                estimator.update(SNR)
+
+        attempts = n
+        while not estimator.done() and attempts < self.calc.NUMBER_OF_SIGNALS:
+            data = self.dut.switch('rx', ant)
+            attempts += 1
+            if not isinstance(data, np.ndarray):
+                continue
+
+            self._store(n, data)
+            estimator.update(self.calc.snr_batch(self.bursts.payload[n:n + 1])[0][0])
+            n += 1
+
+        self.burstCounts[key] = attempts
+        return estimator.mean_db()
+
+    def _measure_snr_offloaded(self, ant, key, limitDb, stable):
+        # bursts are handed to the DSP workers as soon as they arrive and the results are fed to the estimator
+        # in order. without EARLY_STOP the estimator has no limit, so it takes all the bursts
+        estimator = self.calc.estimator(limitDb if self.EARLY_STOP else None)
+        futures = [self.dsp.submit(data) for data in stable]
+        attempts = len(futures)  # DUT switches, including timeouts
+        done = 0
+
+        while not estimator.done():
+            while done < len(futures) and futures[done].done() and not estimator.done():
+                estimator.update(futures[done].result())
+                done += 1
+            if estimator.done():
+                break
+
+            if attempts < self.calc.NUMBER_OF_SIGNALS:
+                data = self.dut.switch('rx', ant)
+                attempts += 1
+                if isinstance(data, np.ndarray):
+                    futures.append(self.dsp.submit(data))
+            elif done == len(futures):
+                break
+            else:
+                # everything was received - wait for the next result
+                estimator.update(futures[done].result())
+                done += 1
+
+        # results which are not needed anymore
+        for future in futures[done:]:
+            future.cancel()
+
+        self.burstCounts[key] = attempts
+        return estimator.mean_db()
+
+    def _store(self, n, data):
+        # copy the burst out of the DUT receive ring before it is reused
+        shape = (self.calc.NUMBER_OF_SIGNALS,) + data.shape
+        if self.bursts is None or self.bursts.shape != shape:
+            self.bursts = FrameBlock(shape[0], shape[1], shape[2], dataType=data.dtype, header=False)
+
+        self.bursts.payload[n] = data
+
+    def report(self):
+        settleTimes = list(self.settle.settleTimes.values())
+        lines = ['Rx sweep: %.3f s' % self.total]
+        lines.append('  tester   %d switches (%d saved)' % (self.testerSwitches,
+                                                            2 * self.ANTENNAS - self.testerSwitches))
+        if settleTimes:
+            lines.append('  settle   total %.3f s, mean %.1f ms, max %.1f ms' % (
+                sum(settleTimes), 1000 * sum(settleTimes) / len(settleTimes), 1000 * max(settleTimes)))
+        if self.burstCounts:
+            counts = list(self.burstCounts.values())
+            lines.append('  bursts   total %d, mean %.1f per measurement' % (sum(counts), sum(counts) / len(counts)))
+        loss = self.dut.lossStats
+        if loss['lossy'] or loss['stale'] or loss['failed']:
+            lines.append('  loss     %d fasts lost in %d of %d bursts, %d stale, %d retries, %d failed' % (
+                loss['lostFasts'], loss['lossy'], loss['bursts'], loss['stale'], loss['retries'], loss['failed']))
+        if self.dsp is not None:
+            m = self.dsp.metrics()
+            lines.append('  dsp      %d bursts, max %d in flight, %d stalls (%.3f s)' % (
+                m['submitted'], m['maxInFlight'], m['stalls'], m['stallTime']))
+
+        return '\n'.join(lines)
@@ -0,0 +1,237 @@
+import socket
+import time
+import unittest
+from threading import Timer
+import numpy as np
+
+import common
+
+NO_FASTS = 35
+NBINS = 8
+WORDS = 16  # words of a receive row (the udp buffer is longer than a fast)
+FAST_BYTES = (NBINS + 1) * 4
+
+
+class AssembleTest(unittest.TestCase):
+    """
+    Imx6Controller.assemble on synthetic bursts: the rows and byte lengths are written into the receive ring
+    the way BatchReceiver leaves them, without a device. The samples of fast k are all k, so an interpolated
+    fast has the value of its position.
+    """
+    BASE = 1000  # sequence number of the first fast of the first burst
+
+    def setUp(self):
+        self.dut = common.Imx6Controller('127.0.0.1', 'DUT')
+        self.dut.NoFasts = NO_FASTS
+        self.dut.Nbins = NBINS
+        self.dut.recvBufferLen = WORDS * 4
+        self.dut.allocate_ring()
+
+    def tearDown(self):
+        self.dut.close()
+
+    def receive(self, fasts, slot=0, lengths=None):
+        # fasts - fast numbers in arrival order (relative to BASE). returns the number of received datagrams
+        rows = self.dut.ring.raw[slot]
+        for i, k in enumerate(fasts):
+            rows[i, 0] = self.BASE + k
+            rows[i, 1:NBINS + 1] = k
+        self.dut.receiver.lengths[slot][:len(fasts)] = FAST_BYTES if lengths is None else lengths
+
+        return len(fasts)
+
+    def assemble(self, fasts, slot=0, lengths=None):
+        return self.dut.assemble(slot, self.receive(fasts, slot, lengths))
+
+    def complete_burst(self):
+        # a first burst with nothing lost, so the numbering of the next one is known
+        self.dut.SEQUENCE_HEADER = True
+        burst = self.assemble(range(NO_FASTS))
+        self.BASE += NO_FASTS
+
+        return burst
+
+    def assertFasts(self, burst, expected):
+        expected = np.repeat(np.asarray(expected, dtype=np.float32)[:, None], NBINS, 1)
+        np.testing.assert_allclose(burst, expected, atol=1e-5)
+
+    def test_complete_burst_is_a_view_of_the_ring(self):
+        burst = self.complete_burst()
+
+        self.assertTrue(np.shares_memory(burst, self.dut.ring.raw))
+        self.assertFasts(burst, range(NO_FASTS))
+        self.assertIsNone(self.dut.present)
+        self.assertEqual(self.dut.lossStats['lossy'], 0)
+
+    def test_gap_in_the_middle_is_interpolated(self):
+        self.complete_burst()
+        fasts = [k for k in range(NO_FASTS) if k not in (10, 11)]
+
+        burst = self.assemble(fasts, slot=1)
+
+        self.assertFasts(burst, range(NO_FASTS))
+        self.assertEqual(list(np.flatnonzero(~self.dut.present)), [10, 11])
+        self.assertEqual(self.dut.lossStats['lostFasts'], 2)
+
+    def test_trailing_loss(self):
+        self.complete_burst()
+
+        burst = self.assemble(range(NO_FASTS - 2), slot=1)
+
+        # the last received fast is copied into the lost ones
+        self.assertFasts(burst, list(range(NO_FASTS - 2)) + [NO_FASTS - 3] * 2)
+        self.assertEqual(list(np.flatnonzero(~self.dut.present)), [NO_FASTS - 2, NO_FASTS - 1])
+
+    def test_leading_loss(self):
+        self.complete_burst()
+
+        burst = self.assemble(range(2, NO_FASTS), slot=1)
+
+        self.assertFasts(burst, [2, 2] + list(range(2, NO_FASTS)))
+        self.assertEqual(list(np.flatnonzero(~self.dut.present)), [0, 1])
+
+    def test_trailing_loss_without_sequence_header(self):
+        burst = self.assemble(range(NO_FASTS - 2))
+
+        self.assertFasts(burst, list(range(NO_FASTS - 2)) + [NO_FASTS - 3] * 2)
+
+    def test_out_of_order_fasts_are_sorted(self):
+        self.complete_burst()
+        fasts = list(range(NO_FASTS))
+        fasts[5], fasts[6] = fasts[6], fasts[5]
+
+        burst = self.assemble(fasts, slot=1)
+
+        self.assertFasts(burst, range(NO_FASTS))
+        self.assertEqual(self.dut.lossStats['lostFasts'], 0)
+
+    def test_stale_fasts_of_the_previous_burst_are_dropped(self):
+        self.complete_burst()
+        # two late fasts of the first burst arrive first, the last two of this burst did not fit in the block
+        fasts = [-2, -1] + list(range(NO_FASTS - 2))
+
+        burst = self.assemble(fasts, slot=1)
+
+        self.assertFasts(burst, list(range(NO_FASTS - 2)) + [NO_FASTS - 3] * 2)
+        self.assertEqual(self.dut.lossStats['stale'], 2)
+        self.assertEqual(self.dut.lossStats['lostFasts'], 2)
+
+    def test_duplicate_fast(self):
+        self.complete_burst()
+        fasts = list(range(NO_FASTS - 1))
+        fasts[20] = 19  # fast 19 twice, fast 20 lost
+
+        burst = self.assemble(fasts, slot=1)
+
+        self.assertFasts(burst, list(range(20)) + [20] + list(range(21, NO_FASTS - 1)) + [NO_FASTS - 2])
+        self.assertEqual(list(np.flatnonzero(~self.dut.present)), [20, NO_FASTS - 1])
+
+    def test_truncated_datagrams_are_lost_fasts(self):
+        self.complete_burst()
+        lengths = np.full(NO_FASTS, FAST_BYTES)
+        lengths[[3, 17]] = FAST_BYTES - 4
+
+        burst = self.assemble(range(NO_FASTS), slot=1, lengths=lengths)
+
+        self.assertFasts(burst, range(NO_FASTS))
+        self.assertEqual(list(np.flatnonzero(~self.dut.present)), [3, 17])
+
+    def test_numbering_jump_anchors_on_the_newest_fast(self):
+        self.complete_burst()
+        self.BASE += 10 * NO_FASTS  # e.g. the app was restarted
+
+        burst = self.assemble(range(2, NO_FASTS), slot=1)
+
+        self.assertFasts(burst, [2, 2] + list(range(2, NO_FASTS)))
+
+    def test_too_many_lost_fasts(self):
+        self.complete_burst()
+        allowed = int(self.dut.MAX_LOSS * NO_FASTS)
+
+        self.assertIsNotNone(self.assemble(range(NO_FASTS - allowed), slot=1))
+        self.BASE += NO_FASTS
+        self.assertIsNone(self.assemble(range(NO_FASTS - allowed - 1), slot=0))
+
+    def test_mask_fill(self):
+        self.complete_burst()
+        self.dut.LOSS_FILL = 'mask'
+
+        burst = self.assemble([k for k in range(NO_FASTS) if k != 10], slot=1)
+
+        self.assertFasts(burst, list(range(10)) + [0] + list(range(11, NO_FASTS)))
+
+
+class FrameBlockTest(unittest.TestCase):
+
+    def test_receive_rows(self):
+        block = common.FrameBlock(2, NO_FASTS, NBINS, WORDS)
+        block.raw[1, 3, :NBINS + 1] = np.arange(NBINS + 1)
+
+        self.assertEqual(block.shape, (2, NO_FASTS, NBINS))
+        self.assertEqual(block.seq[1, 3], 0)
+        self.assertTrue((block.payload[1, 3] == np.arange(1, NBINS + 1)).all())
+
+    def test_payload_only_is_contiguous(self):
+        block = common.FrameBlock(2, NO_FASTS, NBINS, header=False)
+        block.payload[1] = 7
+
+        self.assertIsNone(block.seq)
+        self.assertTrue(block.payload.flags['C_CONTIGUOUS'])
+        self.assertEqual(block.raw.shape, (2, NO_FASTS, NBINS))
+        self.assertTrue((block.raw[1] == 7).all() and (block.raw[0] == 0).all())
+
+
+class BatchReceiverTest(unittest.TestCase):
+    """
+    BatchReceiver on the loopback interface, with recvmmsg and with the recv_into loop.
+    """
+    def setUp(self):
+        self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx.bind(('127.0.0.1', 0))
+        self.rx.settimeout(0.2)
+        self.tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.blocks = [np.zeros([NO_FASTS, WORDS], dtype=np.float32) for i in range(2)]
+
+    def tearDown(self):
+        self.rx.close()
+        self.tx.close()
+
+    def send(self, count, words=NBINS + 1):
+        for k in range(count):
+            self.tx.sendto(np.full(words, k, dtype=np.float32).tobytes(), self.rx.getsockname())
+
+    def check(self, useRecvmmsg):
+        receiver = common.BatchReceiver(self.rx, self.blocks, useRecvmmsg=useRecvmmsg)
+
+        self.send(NO_FASTS)
+        self.assertEqual(receiver.receive(1), NO_FASTS)
+        self.assertTrue((self.blocks[1][:, :NBINS + 1] == np.arange(NO_FASTS)[:, None]).all())
+        self.assertTrue((receiver.lengths[1] == FAST_BYTES).all())
+
+        # a short burst returns on timeout with what was received
+        self.send(5, words=3)
+        self.assertEqual(receiver.receive(0), 5)
+        self.assertTrue((receiver.lengths[0][:5] == 12).all())
+
+    def check_gap(self, useRecvmmsg):
+        # the first datagram is waited for with the socket timeout, a lost one only for gap
+        self.rx.settimeout(2)
+        receiver = common.BatchReceiver(self.rx, self.blocks, useRecvmmsg=useRecvmmsg, gap=0.02)
+        Timer(0.1, self.send, [5]).start()
+
+        start = time.perf_counter()
+        self.assertEqual(receiver.receive(0), 5)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    @unittest.skipIf(common._recvmmsg is None, 'recvmmsg is not available')
+    def test_recvmmsg(self):
+        self.check(True)
+        self.check_gap(True)
+
+    def test_recv_into_loop(self):
+        self.check(False)
+        self.check_gap(False)
+
+
+if __name__ == '__main__':
+    unittest.main()
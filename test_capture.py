@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import capture
+import common
+from sweep import RxSweep, SettleDetector
+
+NO_FASTS = 35
+NBINS = 389
+
+
+def bursts(amplitude, count, seed=0):
+    # [count, NoFasts, Nbins] float32 bursts of a tone in noise
+    rng = np.random.default_rng(seed)
+    n = np.arange(NBINS)
+    tone = amplitude * np.sin(2 * np.pi * 190 / common.Calculator.FFT_LEN * n)
+    return (tone + 0.1 * rng.standard_normal([count, NO_FASTS, NBINS])).astype(np.float32)
+
+
+class FakeDut:
+    """
+    Returns the given bursts one per switch and records them like Imx6Controller.switch.
+    """
+    def __init__(self, data):
+        self.data = list(data)
+        self.recorder = None
+        self.lossStats = {'bursts': 0, 'lossy': 0, 'lostFasts': 0, 'stale': 0, 'retries': 0, 'failed': 0}
+
+    def switch(self, testType, ant):
+        data = self.data.pop(0)
+        if self.recorder is not None:
+            self.recorder.write_burst(data)
+        return data
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'unit.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read(self):
+        reader = capture.CaptureReader(self.path)
+        try:
+            return reader.params, reader.info, [(s, m, i, d.copy()) for s, m, i, d in reader]
+        finally:
+            reader.close()
+
+    def test_round_trip(self):
+        data = bursts(1, 3)
+        spectrum = np.linspace(-60, -20, 801).astype(np.float32)
+
+        writer = capture.CaptureWriter(self.path, {'NoFasts': '35'}, {'sn': 'SN1'})
+        writer.write_burst(data[0])  # no context - not recorded
+        writer.context = ('snr', 4)
+        writer.write_burst(data[1])
+        writer.write_burst(data[2][::2])  # not contiguous
+        writer.context = None
+        writer.write(b'RSA ', 'tx', 7, spectrum)
+        writer.close()
+
+        params, info, chunks = self.read()
+
+        self.assertEqual(params, {'NoFasts': '35'})
+        self.assertEqual(info, {'sn': 'SN1'})
+        self.assertEqual([c[:3] for c in chunks], [('DUT', 'snr', 4), ('DUT', 'snr', 4), ('RSA', 'tx', 7)])
+        np.testing.assert_array_equal(chunks[0][3], data[1])
+        np.testing.assert_array_equal(chunks[1][3], data[2][::2])
+        np.testing.assert_array_equal(chunks[2][3], spectrum[None])
+
+    def test_truncated_chunk_is_ignored(self):
+        data = bursts(1, 2)
+        writer = capture.CaptureWriter(self.path)
+        writer.context = ('cross', 0)
+        writer.write_burst(data[0])
+        writer.write_burst(data[1])
+        writer.close()
+
+        with open(self.path, 'r+b') as fp:
+            fp.truncate(os.path.getsize(self.path) - 100)
+
+        chunks = self.read()[2]
+
+        self.assertEqual(len(chunks), 1)
+        np.testing.assert_array_equal(chunks[0][3], data[0])
+
+    def test_replay_scores_like_the_calculator(self):
+        calc = common.Calculator()
+        snr = bursts(1, 5, seed=1)
+        cross = bursts(0.2, 5, seed=2)
+        spectrum = np.full(801, -60, dtype=np.float32)
+        spectrum[::50] = -20
+
+        writer = capture.CaptureWriter(self.path, info={'sn': 'SN2'})
+        for data in snr:
+            writer.write(b'DUT ', 'snr', 3, data)
+        for data in cross:
+            writer.write(b'DUT ', 'cross', 3, data)
+        writer.write(b'RSA ', 'tx', 2, spectrum)
+        writer.close()
+
+        excel_handler, notPassed = capture.Replay().run(self.path)
+
+        snrDb = calc.snr_batch(snr)[1]
+        self.assertAlmostEqual(excel_handler.rxDf.at[3, 'SNR [dB]'], snrDb, places=4)
+        self.assertAlmostEqual(excel_handler.rxDf.at[3, 'Cross Antenna loss [dB]'],
+                               snrDb - calc.snr_batch(cross)[1], places=4)
+        self.assertEqual(list(excel_handler.txDf.loc[2, ['8.3GHz [dBm]', '8.58GHz [dBm]', '8.9GHz [dBm]']]),
+                         calc.measures(spectrum))
+
+    def test_settle_bursts_are_not_captured(self):
+        # an unstable burst first, then the signal settles - only the measured bursts are in the capture
+        calc = common.Calculator()
+        data = np.concatenate([bursts(5, 1), bursts(1, calc.NUMBER_OF_SIGNALS, seed=3)])
+        dut = FakeDut(data)
+        dut.recorder = capture.CaptureWriter(self.path)
+
+        sweep = RxSweep(None, dut, calc, common.ExcelHandler(), settle=SettleDetector(dut, calc))
+        sweep.EARLY_STOP = False
+        sweep._measure_snr(0, ('snr', 0), None)
+        dut.recorder.close()
+
+        chunks = self.read()[2]
+
+        self.assertEqual(len(chunks), calc.NUMBER_OF_SIGNALS)
+        self.assertTrue(all(c[:3] == ('DUT', 'snr', 0) for c in chunks))
+        np.testing.assert_array_equal(np.stack([c[3] for c in chunks]), data[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+import numpy as np
+
+import common
+from dsp import DspPipeline
+from test_capture import bursts
+
+
+class DspPipelineTest(unittest.TestCase):
+
+    def test_warm_pool_matches_the_calculator(self):
+        data = bursts(1, 4, seed=5)
+        pipeline = DspPipeline(slots=2, workers=2)
+        try:
+            pipeline.warm_up()
+            pool = pipeline.pool
+            SNR = [pipeline.submit(burst).result() for burst in data]
+
+            self.assertIs(pipeline.pool, pool)  # the bursts do not start another pool
+            self.assertEqual(pipeline.metrics()['submitted'], 4)
+        finally:
+            pipeline.close()
+
+        np.testing.assert_allclose(SNR, common.Calculator().snr_batch(data)[0], rtol=1e-5)
+        self.assertIsNone(pipeline.shm)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import numpy as np
+
+import common
+from sweep import RxSweep, SettleDetector
+from test_capture import FakeDut, bursts
+
+
+class TQuantileTest(unittest.TestCase):
+
+    def test_table_values(self):
+        # two sided quantiles of the Student-t table
+        table = {(0.99, 1): 63.657, (0.99, 2): 9.925, (0.99, 3): 5.841, (0.99, 4): 4.604, (0.99, 9): 3.250,
+                 (0.99, 30): 2.750, (0.95, 5): 2.571, (0.95, 20): 2.086}
+        for (confidence, df), t in table.items():
+            self.assertAlmostEqual(common.t_quantile(confidence, df), t, places=3, msg=str((confidence, df)))
+
+    def test_decreases_with_the_degrees_of_freedom(self):
+        quantiles = [common.t_quantile(0.99, df) for df in range(1, 40)]
+
+        self.assertTrue(all(a > b for a, b in zip(quantiles, quantiles[1:])))
+        self.assertGreater(quantiles[-1], 2.576)  # the normal quantile is the limit
+
+
+class SnrEstimatorTest(unittest.TestCase):
+    MIN = 4
+    MAX = 10
+
+    def estimator(self, limitDb):
+        return common.SnrEstimator(limitDb, 0.99, self.MIN, self.MAX)
+
+    def feed(self, estimator, values):
+        # returns the number of values taken until done
+        for n, value in enumerate(values, 1):
+            if estimator.update(value):
+                return n
+        return len(values)
+
+    def test_above(self):
+        estimator = self.estimator(20)
+
+        self.assertEqual(self.feed(estimator, 1000 * (1 + 0.01 * np.sin(np.arange(self.MAX)))), self.MIN)
+        self.assertEqual(estimator.decision, 'above')
+
+    def test_below(self):
+        estimator = self.estimator(20)
+
+        self.assertEqual(self.feed(estimator, 10 * (1 + 0.01 * np.sin(np.arange(self.MAX)))), self.MIN)
+        self.assertEqual(estimator.decision, 'below')
+
+    def test_min_signals_floor(self):
+        # clearly above after two bursts, but no decision before MIN
+        estimator = self.estimator(20)
+        for n in range(self.MIN - 1):
+            self.assertFalse(estimator.update(1000 + n))
+            self.assertIsNone(estimator.decision)
+
+        self.assertTrue(estimator.update(1000))
+
+    def test_marginal_takes_max_count(self):
+        # a mean at the limit is never decided, the estimator stops at maxCount
+        estimator = self.estimator(20)
+
+        self.assertEqual(self.feed(estimator, 100 * (1 + 0.2 * np.sin(np.arange(2 * self.MAX)))), self.MAX)
+        self.assertIsNone(estimator.decision)
+        self.assertTrue(estimator.done())
+
+    def test_no_limit_takes_max_count(self):
+        estimator = self.estimator(None)
+
+        self.assertEqual(self.feed(estimator, np.full(2 * self.MAX, 1000.0)), self.MAX)
+        self.assertIsNone(estimator.decision)
+
+    def test_bounds(self):
+        estimator = common.SnrEstimator(None, 0.95, self.MIN, self.MAX)
+        estimator.update(1)
+        self.assertEqual(estimator.bounds_db(), (-np.inf, np.inf))
+
+        for value in [5, 3]:
+            estimator.update(value)
+        # mean 3, standard deviation 2, t(0.95, 2) = 4.303
+        halfWidth = 4.303 * 2 / np.sqrt(3)
+        lower, upper = estimator.bounds_db()
+
+        self.assertAlmostEqual(estimator.mean_db(), 10 * np.log10(3))
+        self.assertAlmostEqual(upper, 10 * np.log10(3 + halfWidth), places=3)
+        self.assertEqual(lower, -np.inf)  # the interval reaches below 0
+        self.assertEqual(list(estimator.quantiles), [2])
+
+
+class EarlyStopTest(unittest.TestCase):
+    """
+    RxSweep._measure_snr with the Calculator estimator: the bursts a measurement takes.
+    The simulated bursts have an SNR of about 29.5 dB.
+    """
+    def measure(self, limitDb, data):
+        calc = common.Calculator()
+        dut = FakeDut(data)
+        sweep = RxSweep(None, dut, calc, None, settle=SettleDetector(dut, calc))
+
+        SNR = sweep._measure_snr(0, ('snr', 0), limitDb)
+
+        return sweep.burstCounts[('snr', 0)], SNR
+
+    def test_clear_pass_stops_at_min_signals(self):
+        count, SNR = self.measure(10, bursts(1, 20, seed=4))
+
+        self.assertEqual(count, common.Calculator.MIN_SIGNALS)
+        self.assertGreater(SNR, 25)
+
+    def test_clear_fail_stops_at_min_signals(self):
+        self.assertEqual(self.measure(45, bursts(1, 20, seed=4))[0], common.Calculator.MIN_SIGNALS)
+
+    def test_marginal_takes_all_the_bursts(self):
+        calc = common.Calculator()
+        SNR = calc.snr_batch(bursts(1, calc.NUMBER_OF_SIGNALS, seed=4))[1]
+
+        self.assertEqual(self.measure(SNR, bursts(1, 20, seed=4))[0], calc.NUMBER_OF_SIGNALS)
+
+    def test_timeouts_count_as_bursts(self):
+        # a burst which could not be received (0) takes its turn of the NUMBER_OF_SIGNALS
+        calc = common.Calculator()
+        data = list(bursts(1, 2, seed=4)) + [0] * calc.NUMBER_OF_SIGNALS
+
+        count, SNR = self.measure(10, data)
+
+        self.assertEqual(count, calc.NUMBER_OF_SIGNALS)
+        self.assertGreater(SNR, 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+
+import common
+
+SN = 'SN7'
+INFO = ['3.1', SN, 'eth', 'wlan']
+
+
+class JournalTest(unittest.TestCase):
+    """
+    Journal of the measurements of ExcelHandler: recovery of an interrupted run into its final report.
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def handler(self):
+        excel_handler = common.ExcelHandler()
+        excel_handler.filePath = os.path.join(self.folder, '')
+
+        return excel_handler
+
+    def interrupted_run(self, passing=False):
+        # an ExcelHandler which recorded measurements and never reached final_excel.
+        # passing - every measurement 10 dB above its limit, else the tx ones only
+        excel_handler = self.handler()
+        excel_handler.set_device_info(INFO)
+        measured = [('tx', excel_handler.txDf, excel_handler.txRef)]
+        if passing:
+            measured.append(('rx', excel_handler.rxDf, excel_handler.rxRef))
+        for sheet, df, ref in measured:
+            for row in df.index:
+                for column in df.columns[1:]:
+                    excel_handler.record(sheet, row, column, ref.at[row, column] + 10)
+        excel_handler.close_journal()
+
+        return excel_handler
+
+    def files(self):
+        return sorted(os.listdir(self.folder))
+
+    def test_recover_writes_the_final_report(self):
+        self.interrupted_run()
+
+        excel_handler = self.handler()
+        self.assertIsNotNone(excel_handler.leftover_journal(SN))
+        self.assertEqual(excel_handler.recover(SN), 24)
+
+        # the rx measurements were not reached - they fail
+        self.assertEqual(excel_handler.reportPath, os.path.join(self.folder, 'Failed_' + SN + '.xlsx'))
+        self.assertEqual(self.files(), ['Failed_' + SN + '.xlsx'])  # no journal or intermediate workbook left
+        tx = pd.read_excel(excel_handler.reportPath, sheet_name='Tx test', index_col=0)
+        self.assertAlmostEqual(tx.at[3, '8.58GHz [dBm]'], excel_handler.txRef.at[3, '8.58GHz [dBm]'] + 10, 2)
+        info = pd.read_excel(excel_handler.reportPath, sheet_name='Device info')
+        self.assertEqual(str(info.iloc[0, 1]), SN)
+
+    def test_recover_complete_run_passes(self):
+        self.interrupted_run(passing=True)
+
+        excel_handler = self.handler()
+        self.assertEqual(excel_handler.recover(SN), 24 + 64)
+
+        self.assertEqual(self.files(), ['Pass_' + SN + '.xlsx'])
+
+    def test_torn_last_line(self):
+        self.interrupted_run()
+        with open(os.path.join(self.folder, SN + '.jsonl'), 'a') as fp:
+            fp.write('{"sheet": "rx", "row": 0, "colu')  # the run died while writing
+
+        excel_handler = self.handler()
+
+        self.assertEqual(excel_handler.recover(SN), 24)
+        self.assertEqual(excel_handler.rxDf.at[0, 'SNR [dB]'], 0)
+
+    def test_new_run_rotates_a_leftover_journal(self):
+        self.interrupted_run()
+        with open(os.path.join(self.folder, SN + '.jsonl')) as fp:
+            leftover = fp.read()
+
+        excel_handler = self.handler()
+        excel_handler.set_device_info(INFO)
+        excel_handler.close_journal()
+
+        rotated = [name for name in self.files() if name not in [SN + '.jsonl']]
+        self.assertEqual(len(rotated), 1)
+        self.assertRegex(rotated[0], '^' + SN + r'\.\d{8}_\d{6}\.jsonl$')
+        with open(os.path.join(self.folder, rotated[0])) as fp:
+            self.assertEqual(fp.read(), leftover)
+        with open(os.path.join(self.folder, SN + '.jsonl')) as fp:
+            self.assertEqual(len(fp.readlines()), 1)  # the info of the new run only
+
+    def test_final_excel_removes_the_journal(self):
+        excel_handler = self.interrupted_run(passing=True)
+
+        notPassed = excel_handler.evaluate()
+        excel_handler.final_excel(notPassed, SN, excel_handler.tx_test_excel(SN), excel_handler.rx_test_excel(SN))
+
+        self.assertEqual(notPassed, 0)
+        self.assertEqual(self.files(), ['Pass_' + SN + '.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from bench import FakeRsaResource
+
+
+class SetupStateTest(unittest.TestCase):
+    """
+    RSaDriver.load_setup against the simulated SignalVu: a setup is recalled only when SignalVu does not hold it,
+    also across sessions (a new driver per unit).
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.resource = FakeRsaResource()  # SignalVu keeps its state between sessions
+        for name in ['tx_setup.Setup', 'rx_setup.Setup']:
+            with open(os.path.join(self.folder, name), 'w') as fp:
+                fp.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def session(self):
+        rsa = common.RSaDriver()
+        rsa.rsa = self.resource
+        rsa.isConnected = True
+        rsa.config()
+        rsa.txSetupFile = os.path.join(self.folder, 'tx_setup.Setup')
+        rsa.rxSetupFile = os.path.join(self.folder, 'rx_setup.Setup')
+        rsa.STATE_FILE = os.path.join(self.folder, 'rsa_state.json')
+
+        return rsa
+
+    def recalls(self):
+        return sum(cmd.upper().startswith('MMEMORY:LOAD:STATE') for cmd in self.resource.commands)
+
+    def test_same_session(self):
+        rsa = self.session()
+
+        self.assertTrue(rsa.load_setup('tx'))
+        self.assertFalse(rsa.load_setup('tx'))
+        self.assertTrue(rsa.load_setup('rx'))
+        self.assertEqual(self.recalls(), 2)
+
+    def test_next_session_skips_the_held_setup(self):
+        self.session().load_setup('rx')
+
+        rsa = self.session()
+
+        self.assertEqual(rsa.loaded_setup(), 'rx')
+        self.assertFalse(rsa.load_setup('rx'))
+        self.assertEqual(self.recalls(), 1)
+
+    def test_changed_measurement_is_recalled(self):
+        self.session().load_setup('tx')
+        self.resource.settings['DISPlay:WINDow:ACTive:MEASurement?'] = 'dpx'  # e.g. changed by hand on SignalVu
+
+        rsa = self.session()
+
+        self.assertIsNone(rsa.loaded_setup())
+        self.assertTrue(rsa.load_setup('tx'))
+
+    def test_preset_is_recalled(self):
+        # a restarted (or preset) SignalVu shows 'specan' too, but not the MaxHold trace of the tx setup
+        self.session().load_setup('tx')
+        self.resource.preset()
+
+        rsa = self.session()
+
+        self.assertIsNone(rsa.loaded_setup())
+        self.assertTrue(rsa.load_setup('tx'))
+        self.assertEqual(self.resource.settings['TRACe1:SPECtrum:FUNCtion?'], 'MAXHold')
+
+    def test_changed_span_is_recalled(self):
+        self.session().load_setup('tx')
+        self.resource.settings['SENSe:SPECtrum:FREQuency:SPAN?'] = '1.0E+9'
+
+        self.assertTrue(self.session().load_setup('tx'))
+
+    def test_changed_file_is_recalled(self):
+        self.session().load_setup('tx')
+        with open(os.path.join(self.folder, 'tx_setup.Setup'), 'w') as fp:
+            fp.write('new tx setup')
+
+        self.assertTrue(self.session().load_setup('tx'))
+
+    def test_no_state_file(self):
+        self.session().load_setup('tx')
+        os.remove(os.path.join(self.folder, 'rsa_state.json'))
+
+        self.assertTrue(self.session().load_setup('tx'))
+
+    def test_recall_timeout(self):
+        rsa = self.session()
+        timeouts = []
+        query = self.resource.query
+        self.resource.query = lambda cmd: timeouts.append(self.resource.timeout) or query(cmd)
+
+        rsa.load_setup('tx')
+
+        self.assertIn(rsa.RECALL_TIMEOUT, timeouts)
+        self.assertEqual(self.resource.timeout, 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
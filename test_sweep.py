@@ -0,0 +1,102 @@
+import threading
+import unittest
+import numpy as np
+
+import common
+from sweep import ResourceScheduler, TxSweep
+
+
+class FakeDevice:
+    """
+    Tester or DUT: every switch is logged with the sweep still holding the tester or not.
+    """
+    def __init__(self, name, log, scheduler):
+        self.name = name
+        self.log = log
+        self.scheduler = scheduler
+        self.recorder = None
+
+    def switch(self, testType, ant):
+        self.log.append((self.name, ant, self.scheduler.locks['tester'].locked()))
+        return 1
+
+
+class FakeRsa:
+    """
+    RSA of the command queue: logs the clears and fetches, and if the tester was held during the fetch.
+    """
+    def __init__(self, log, scheduler):
+        self.log = log
+        self.scheduler = scheduler
+        self.queue = common.RsaCommandQueue()
+        self.spectrum = np.full(801, -60, dtype=np.float32)
+
+    def refresh_trace(self):
+        self.log.append(('clear', None, self.scheduler.locks['tester'].locked()))
+
+    def get_spectrum_curve(self):
+        self.log.append(('fetch', None, self.scheduler.locks['tester'].locked()))
+        return self.spectrum
+
+
+class FakeExcel:
+    """
+    Logs a measure (its first record) with the thread it ran on.
+    """
+    def __init__(self, log):
+        self.log = log
+        self.txDf = {}
+
+    def record(self, sheet, row, column, value):
+        if (row, '8.3GHz [dBm]') not in self.txDf:
+            self.log.append(('measure', row, threading.current_thread() is threading.main_thread()))
+        self.txDf[row, column] = value
+
+
+class TxSweepTest(unittest.TestCase):
+
+    def sweep(self, shared):
+        scheduler = ResourceScheduler()
+        self.log = []
+        self.rsa = FakeRsa(self.log, scheduler)
+        sweep = TxSweep(FakeDevice('tester', self.log, scheduler), FakeDevice('dut', self.log, scheduler), self.rsa,
+                        common.Calculator(), FakeExcel(self.log), scheduler=scheduler if shared else None)
+        sweep.scheduler = scheduler
+        sweep.SETTLE_TIME = 0
+        sweep.BURSTS = 2
+        self.results = sweep.run()
+        self.rsa.queue.close()
+
+        return scheduler
+
+    def fetches(self):
+        return [held for name, ant, held in self.log if name == 'fetch']
+
+    def test_shared_tester_is_held_until_the_fetch(self):
+        # no other DUT can burst into the MaxHold trace before it is fetched
+        scheduler = self.sweep(shared=True)
+
+        self.assertEqual(self.fetches(), [True] * TxSweep.SECTORS)
+        self.assertFalse(scheduler.locks['tester'].locked())
+        self.assertFalse(scheduler.locks['rsa'].locked())
+
+    def test_alone_tester_is_released_after_the_burst(self):
+        scheduler = self.sweep(shared=False)
+
+        self.assertEqual(len(self.fetches()), TxSweep.SECTORS)
+        self.assertEqual(len(self.results), 3 * TxSweep.SECTORS)
+        self.assertFalse(scheduler.locks['rsa'].locked())
+
+    def test_order(self):
+        # only the fetch runs on the RSA queue, sector i-1 is measured by the sweep thread after the clear of i
+        self.sweep(shared=True)
+
+        names = [name for name, ant, held in self.log]
+        sector = ['tester', 'clear', 'measure', 'dut', 'dut', 'fetch']
+        self.assertEqual(names, sector[:2] + sector[3:] + sector * (TxSweep.SECTORS - 1) + ['measure'])
+        measures = [(ant, held) for name, ant, held in self.log if name == 'measure']
+        self.assertEqual(measures, [(i, True) for i in range(TxSweep.SECTORS)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+import unittest
+import numpy as np
+
+import common
+import transport
+from bench import SimRig
+
+
+class TransportTest(unittest.TestCase):
+    """
+    AsyncImx6Controller and connect_all against the simulated tester and DUT (bench.SimRig).
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.rig = SimRig()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.rig.close()
+
+    def test_connect_all(self):
+        self.assertTrue(self.rig.tester.isConnected)
+        self.assertTrue(self.rig.dut.isConnected)
+        self.assertEqual(self.rig.dut.Nbins, self.rig.simDut.Nbins)
+
+    def test_async_switch_uses_the_receive_ring(self):
+        dut = transport.AsyncImx6Controller(self.rig.dut)
+
+        burst = transport.run(dut.switch('rx', 3))
+
+        self.assertEqual(burst.shape, (self.rig.dut.NoFasts, self.rig.dut.Nbins))
+        self.assertTrue(np.shares_memory(burst, self.rig.dut.ring.raw))
+        # the blocking path reads the next burst from the same socket
+        self.assertIsInstance(self.rig.dut.switch('rx', 3), np.ndarray)
+
+    def test_tester_and_dut_wait_together(self):
+        tester = transport.AsyncImx6Controller(self.rig.tester)
+        dut = transport.AsyncImx6Controller(self.rig.dut)
+
+        async def both():
+            return await transport.asyncio.gather(tester.switch('rx', 0), dut.switch('rx', 0))
+
+        ack, burst = transport.run(both())
+
+        self.assertEqual(ack, 1)
+        self.assertIsInstance(burst, np.ndarray)
+
+    def test_timeout_cancels_the_pending_connects(self):
+        # nothing answers on this address
+        dut = common.Imx6Controller('127.0.0.4', 'DUT')
+        dut.ping = lambda IP: True
+        dut.configFilePath = self.rig.dut.configFilePath
+        dut.load_params()
+        try:
+            start = time.perf_counter()
+            self.assertFalse(transport.run(transport.connect_all(None, dut, timeout=0.2)))
+            self.assertLess(time.perf_counter() - start, 1)
+        finally:
+            dut.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Timing spans of the hot path (connect, discovery, SSH, tester switch, DUT burst, RSA fetch, DSP, Excel).
+    Every span is tagged with the DUT of its thread (set_dut), so one station run can be split per unit.
+    Spans are exported as a Chrome trace (chrome://tracing, Perfetto) and summarized as histograms.
+    """
+    # histogram bucket upper bounds [ms]
+    BUCKETS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.enabled = True
+        self.spans = []  # (name, category, dut, thread name, start [s], duration [s])
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    def set_dut(self, sn):
+        # spans of the calling thread are tagged with sn from now on
+        self.local.dut = sn
+
+    def current_dut(self):
+        return getattr(self.local, 'dut', None)
+
+    @contextmanager
+    def span(self, name, category='app'):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            span = (name, category, self.current_dut(), threading.current_thread().name,
+                    start - self.origin, duration)
+            with self.lock:
+                self.spans.append(span)
+
+    def traced(self, name=None, category='app'):
+        # decorator - a span for every call of the function (name defaults to its qualified name)
+        def decorator(func):
+            spanName = func.__qualname__ if name is None else name
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(spanName, category):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def durations(self, dut=None):
+        # span name -> list of durations [s]
+        result = {}
+        with self.lock:
+            spans = list(self.spans)
+        for name, category, spanDut, thread, start, duration in spans:
+            if dut is None or spanDut == dut:
+                result.setdefault(name, []).append(duration)
+
+        return result
+
+    def histogram(self, durations):
+        # number of durations in every bucket of BUCKETS (last one is everything above)
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for duration in durations:
+            ms = 1000 * duration
+            i = 0
+            while i < len(self.BUCKETS) and ms > self.BUCKETS[i]:
+                i += 1
+            counts[i] += 1
+
+        return counts
+
+    def report(self, dut=None):
+        # aggregate per span name: calls, total, mean, p50, p95, max and the histogram
+        lines = []
+        for name, durations in sorted(self.durations(dut).items(), key=lambda item: -sum(item[1])):
+            ordered = sorted(durations)
+            n = len(ordered)
+            lines.append('%-40s %6d calls, total %8.3f s, mean %8.2f ms, p50 %8.2f ms, p95 %8.2f ms, max %8.2f ms' % (
+                name, n, sum(ordered), 1000 * sum(ordered) / n, 1000 * ordered[n // 2],
+                1000 * ordered[min(n - 1, int(0.95 * n))], 1000 * ordered[-1]))
+
+            counts = self.histogram(durations)
+            labels = ['<=%gms' % b for b in self.BUCKETS] + ['>%gms' % self.BUCKETS[-1]]
+            lines.append('    ' + ' '.join('%s:%d' % (label, c) for label, c in zip(labels, counts) if c))
+
+        return '\n'.join(lines)
+
+    def export_chrome(self, path, dut=None):
+        # Chrome trace event format: every DUT is a process, every thread a track
+        with self.lock:
+            spans = list(self.spans)
+
+        events = []
+        pids = {}
+        tids = {}
+        for name, category, spanDut, thread, start, duration in spans:
+            if dut is not None and spanDut != dut:
+                continue
+
+            # ids are numbers, the names go to metadata events
+            label = 'DUT ' + spanDut if spanDut else 'Station'
+            if label not in pids:
+                pids[label] = len(pids) + 1
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pids[label], 'args': {'name': label}})
+            if (label, thread) not in tids:
+                tids[(label, thread)] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pids[label], 'tid': tids[(label, thread)],
+                               'args': {'name': thread}})
+
+            events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': 1e6 * start, 'dur': 1e6 * duration,
+                           'pid': pids[label], 'tid': tids[(label, thread)]})
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        return path
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+
+tracer = Tracer()
+traced = tracer.traced
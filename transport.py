@@ -0,0 +1,153 @@
+import asyncio
+import select
+
+from tracing import tracer
+
+CONNECT_TIMEOUT = 10  # seconds for connecting all the devices of connect_all
+
+
+def run(coroutine):
+    # runs a coroutine on a selector event loop (add_reader is not available on the proactor loop of windows)
+    loop = asyncio.SelectorEventLoop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def wait_readable(sock, timeout):
+    # True when a datagram is waiting on the socket, False on timeout. the wait is cancellable
+    if select.select([sock], [], [], 0)[0]:
+        return True
+
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: ready.done() or ready.set_result(True))
+    try:
+        return await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+async def receive(receiver, blockIdx):
+    # BatchReceiver.receive on the event loop: the same rows and deadlines (socket timeout for the first
+    # datagram, gap for every next one), the waits let the other devices run
+    n = len(receiver.rows[blockIdx])
+    timeout = receiver.sock.gettimeout()
+    received = 0
+
+    while received < n:
+        wait = timeout if received == 0 or receiver.gap is None else receiver.gap
+        if not await wait_readable(receiver.sock, wait):
+            break
+
+        received = receiver.receive_ready(blockIdx, received)
+
+    return received
+
+
+class AsyncImx6Controller:
+    """
+    asyncio front end of an Imx6Controller (DUT or Tester) for the INIT/SWITCH protocol.
+    It uses the socket, receive ring, BatchReceiver and assemble of the controller, so a device connected
+    here is used by the (blocking) sweeps as it is. Tester acks, DUT bursts and blocking calls run in
+    executors (RSA, ping) wait on one event loop at the same time, with timeouts and cancellation from asyncio.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+
+    async def recv(self, timeout=None):
+        # next datagram from the device, None on timeout
+        c = self.controller
+        if not await wait_readable(c, c.gettimeout() if timeout is None else timeout):
+            return None
+
+        return c.recv(c.recvBufferLen)
+
+    async def connect(self):
+        c = self.controller
+        loop = asyncio.get_running_loop()
+
+        if not await loop.run_in_executor(None, c.ping, c.IP):
+            print('Cannot ping to ' + c.mode)
+            return c.isConnected
+        if c.fileContentTXT is None:
+            print("Load novelda params file first !!!")
+            return 0
+
+        c.configure_socket()
+        c._drain()
+
+        # send command through udp
+        c.sendto(c.init_command(), c.serverAddress)
+
+        if c.mode == 'TESTER':
+            if await self.switch('tx', 1):
+                print("### Tester: is connected")
+                c.isConnected = True
+            else:
+                print("### Tester: app isn't running")
+            return c.isConnected
+
+        # receive ack ( only for DUT ). anything else (a late fast of an earlier session) is skipped
+        while True:
+            data = await self.recv()
+            if data is None:
+                print("### DUT: app isn't running")
+                return c.isConnected
+
+            Nbins = c.parse_ack(data) if len(data) == 3 else None
+            if Nbins is not None:
+                c.Nbins = Nbins
+                print("### DUT: is connected")
+                c.isConnected = True
+                return c.Nbins
+
+    async def switch(self, testType, ant):
+        # same results as Imx6Controller.switch: 1 or the burst [NoFasts, Nbins] (valid for RING_SIZE switches),
+        # 0 on timeout
+        c = self.controller
+        with tracer.span(c.span_name(), 'imx6'):
+            data = await self._switch(testType, ant)
+
+        return c.record(data)
+
+    async def _switch(self, testType, ant):
+        c = self.controller
+
+        if c.mode == 'TESTER':
+            c.sendto(c.switch_command(testType, ant), c.serverAddress)
+            if await self.recv() is None:
+                print("Time out !!!")
+                return 0
+            return 1
+
+        slot = c.next_slot()
+
+        for attempt in range(c.RETRIES + 1):
+            c.request(testType, ant, attempt)
+
+            burst = c.assemble(slot, await receive(c.receiver, slot))
+            if burst is not None:
+                return burst
+
+        return c.give_up()
+
+
+async def connect_all(rsa, *controllers, timeout=CONNECT_TIMEOUT):
+    # connects the RSA (blocking VISA, in a thread) and the imx6 controllers at the same time on one event loop.
+    # returns True if all of them are connected. the connects still pending after timeout are cancelled
+    loop = asyncio.get_running_loop()
+    tasks = [AsyncImx6Controller(c).connect() for c in controllers]
+    if rsa is not None:
+        tasks.append(loop.run_in_executor(None, rsa.connect))
+
+    with tracer.span('connect all', 'imx6'):
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout)
+        except asyncio.TimeoutError:
+            print('### Connect timed out')
+
+    return all(c.isConnected for c in controllers) and (rsa is None or rsa.isConnected)